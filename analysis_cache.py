@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+# Two-tier cache for model analyses: an in-memory LRU in front of a directory
+# of JSON files, so results survive restarts and are shared between processes.
+# Pruning lists the whole directory, so writes only trigger it every prune_every writes or
+# prune_interval seconds (and on the first write); in between the directory may run over
+# max_disk_bytes by the entries written since.
+class AnalysisCache:
+    def __init__(self, directory, max_memory_entries=256, max_disk_bytes=256 * 1024 * 1024, max_age=7 * 24 * 3600,
+                 prune_every=100, prune_interval=300):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self.prune_interval = prune_interval
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self._last_prune = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("COPILOT_CACHE_DIR", os.path.join(".cache", "analysis")),
+            max_memory_entries=int(os.environ.get("COPILOT_CACHE_MEMORY_ENTRIES", 256)),
+            max_disk_bytes=int(os.environ.get("COPILOT_CACHE_DISK_BYTES", 256 * 1024 * 1024)),
+            max_age=float(os.environ.get("COPILOT_CACHE_MAX_AGE", 7 * 24 * 3600)),
+        )
+
+    @staticmethod
+    def make_key(image_bytes, *parts):
+        """Content address for an image plus whatever shaped the answer (model, prompt)."""
+        digest = hashlib.sha256(image_bytes)
+        for part in parts:
+            digest.update(b"\0")
+            digest.update(str(part).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.max_age:
+                    self._memory.move_to_end(key)
+                    return entry[1]
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if now - entry["created"] > self.max_age:
+            self._remove(path)
+            return None
+
+        # Touch the file so size-based eviction drops the least recently used entries first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(key, entry["created"], entry["value"])
+        return entry["value"]
+
+    def set(self, key, value):
+        created = time.time()
+        self._remember(key, created, value)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "value": value}, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            return
+        if self._prune_due(created):
+            self.prune()
+
+    def _prune_due(self, now):
+        with self._lock:
+            self._writes_since_prune += 1
+            if self._writes_since_prune < self.prune_every and now - self._last_prune < self.prune_interval:
+                return False
+            self._writes_since_prune = 0
+            self._last_prune = now
+            return True
+
+    def _remember(self, key, created, value):
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def prune(self):
+        """Drop expired files, then the least recently used ones until under the size budget."""
+        now = time.time()
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self._remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for name in os.listdir(self.directory):
+            self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,94 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace: "What are the outliers?" -> "what are the outliers"."""
+    return " ".join(re.findall(r"[a-z0-9]+", question.lower()))
+
+
+def tfidf_similarity(question, candidates):
+    """Cosine similarity of TF-IDF vectors of question against each candidate, with IDF over all of them."""
+    documents = [question.split()] + [candidate.split() for candidate in candidates]
+    document_frequency = Counter(word for words in documents for word in set(words))
+    idf = {word: math.log((1 + len(documents)) / (1 + count)) + 1 for word, count in document_frequency.items()}
+
+    vectors = []
+    for words in documents:
+        vector = {word: count * idf[word] for word, count in Counter(words).items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        vectors.append({word: value / norm for word, value in vector.items()})
+
+    query = vectors[0]
+    return [sum(value * vector.get(word, 0.0) for word, value in query.items()) for vector in vectors[1:]]
+
+
+# In-memory LRU of follow-up answers. Entries live in a scope (the image plus the conversation
+# that preceded the question) and are looked up by normalized question; with a similarity
+# threshold set, the closest cached question of the scope also counts when its TF-IDF cosine
+# similarity reaches the threshold.
+class AnswerCache:
+    def __init__(self, max_entries=1024, max_age=24 * 3600, similarity=0.0):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.environ.get("COPILOT_ANSWER_CACHE_ENTRIES", 1024)),
+            max_age=float(os.environ.get("COPILOT_ANSWER_CACHE_MAX_AGE", 24 * 3600)),
+            similarity=float(os.environ.get("COPILOT_ANSWER_SIMILARITY", 0)),
+        )
+
+    def get(self, scope, question):
+        question = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            key = (scope, question)
+            if key not in self._entries and self.similarity > 0:
+                key = self._closest(scope, question)
+            if key is None or key not in self._entries:
+                return None
+            created, value = self._entries[key]
+            if now - created > self.max_age:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, scope, question, value):
+        key = (scope, normalize_question(question))
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            self._scopes.setdefault(scope, set()).add(key[1])
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def _closest(self, scope, question):
+        candidates = list(self._scopes.get(scope, ()))
+        if not candidates or not question:
+            return None
+        score, best = max(zip(tfidf_similarity(question, candidates), candidates))
+        return (scope, best) if score >= self.similarity else None
+
+    def _drop(self, key):
+        del self._entries[key]
+        questions = self._scopes.get(key[0])
+        if questions is not None:
+            questions.discard(key[1])
+            if not questions:
+                del self._scopes[key[0]]
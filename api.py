@@ -0,0 +1,294 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+import zipfile
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import httpx
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+import http_client
+import metrics
+from copilot_core import (
+    analyze_image_cached_async,
+    analyze_image_cached_stream_async,
+    analyze_pages_async,
+    get_image_pool,
+    page_count,
+    summarize_pages_async,
+)
+from http_client import UpstreamError
+from image_pool import ImagePoolBusy
+from job_queue import JobQueue
+
+# Headless API entry point: uvicorn api:app
+logger = logging.getLogger("copilot.api")
+
+@asynccontextmanager
+async def lifespan(app):
+    await get_image_pool().start()
+    queue = await asyncio.to_thread(get_job_queue) if JOB_WORKERS else None
+    workers = [asyncio.create_task(job_worker(queue)) for _ in range(JOB_WORKERS)]
+    yield
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await http_client.close_async_client()
+    get_image_pool().shutdown()
+
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
+
+def record_http_request(request, status, start):
+    elapsed = time.perf_counter() - start
+    # Label by route template, not raw path, to keep the number of series bounded
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.observe("copilot_http_request_duration_seconds", elapsed, route=route, status=status)
+    metrics.log_request("http_request", method=request.method, route=route, status=status, seconds=round(elapsed, 4))
+
+# Requests are timed until the last byte of the body is sent, so streamed analyses (SSE, NDJSON)
+# count their full duration rather than the time to their headers
+@app.middleware("http")
+async def record_request(request, call_next):
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        record_http_request(request, 500, start)
+        raise
+
+    body = response.body_iterator
+
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            record_http_request(request, response.status_code, start)
+
+    response.body_iterator = timed_body()
+    return response
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# (status code, message) for an error raised while analyzing an upload, or None for a bug
+def analysis_error(e):
+    from PIL import Image
+
+    if isinstance(e, ImagePoolBusy):
+        return 503, str(e)
+    if isinstance(e, TimeoutError):
+        return 504, "Timed out preparing the image"
+    if isinstance(e, httpx.TimeoutException):
+        return 504, "Timed out waiting for the model"
+    if isinstance(e, UpstreamError):
+        return 503 if e.status_code == 429 else 502, str(e)
+    if isinstance(e, httpx.HTTPError):
+        return 502, f"Could not reach the model: {str(e) or type(e).__name__}"
+    if isinstance(e, Image.DecompressionBombError):
+        return 400, str(e)
+    if isinstance(e, ValueError):
+        return 413, str(e)
+    if isinstance(e, OSError):
+        # Includes UnidentifiedImageError and truncated files
+        return 400, "Could not read image"
+    return None
+
+def error_message(e):
+    error = analysis_error(e)
+    return error[1] if error else str(e) or type(e).__name__
+
+@app.post("/analyze")
+async def analyze_image(file: UploadFile = File(...)):
+    contents = await file.read()
+
+    try:
+        openai_analysis = await analyze_image_cached_async(contents)
+    except Exception as e:
+        error = analysis_error(e)
+        if error is None:
+            raise
+        status, detail = error
+        raise HTTPException(status_code=status, detail=detail, headers={"Retry-After": "1"} if isinstance(e, ImagePoolBusy) else None)
+    return {"openai_analysis": openai_analysis}
+
+# Same analysis as /analyze, sent as server-sent events while the model generates it; every
+# stream ends with [DONE], after an {"error": ...} event if the analysis failed
+@app.post("/analyze/stream")
+async def analyze_image_stream(file: UploadFile = File(...)):
+    contents = await file.read()
+
+    async def events():
+        try:
+            async for delta in analyze_image_cached_stream_async(contents):
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except Exception as e:
+            error = analysis_error(e)
+            if error is None:
+                logger.exception("analysis stream failed")
+            yield f"data: {json.dumps({'error': error[1] if error else 'Internal error'})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# Multi-page uploads (multi-frame TIFF reports): one NDJSON line per page, numbered from 1, as
+# each page finishes, then with summary=true a final {"summary": ...} line across all pages
+@app.post("/analyze/pages")
+async def analyze_pages(file: UploadFile = File(...), summary: bool = Query(False)):
+    contents = await file.read()
+    try:
+        pages = await run_in_threadpool(page_count, contents)
+    except Exception as e:
+        error = analysis_error(e)
+        if error is None:
+            raise
+        raise HTTPException(status_code=error[0], detail=error[1])
+
+    async def results():
+        analyses = {}
+        async for result in analyze_pages_async(contents, pages):
+            if "openai_analysis" in result:
+                analyses[result["page"]] = result["openai_analysis"]
+            yield json.dumps(result) + "\n"
+        if summary and analyses:
+            try:
+                yield json.dumps({"summary": await summarize_pages_async(sorted(analyses.items()))}) + "\n"
+            except (httpx.HTTPError, UpstreamError, TimeoutError) as e:
+                yield json.dumps({"summary_error": str(e) or type(e).__name__}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+BATCH_PARALLELISM = int(os.environ.get("COPILOT_BATCH_PARALLELISM", 8))
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".tif")
+
+# Expand uploaded zip archives into (filename, bytes) pairs of the images they contain
+def unpack_batch(uploads):
+    images = []
+    for filename, contents in uploads:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                        images.append((info.filename, archive.read(info)))
+        else:
+            images.append((filename, contents))
+    return images
+
+# Analyze many charts at once; results are streamed as NDJSON lines in completion order
+@app.post("/analyze/batch")
+async def analyze_batch(files: list[UploadFile] = File(...), parallelism: int = Query(None, ge=1)):
+    uploads = [(file.filename or "", await file.read()) for file in files]
+    try:
+        images = await run_in_threadpool(unpack_batch, uploads)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Could not read zip archive")
+
+    batch_slots = asyncio.Semaphore(min(parallelism or BATCH_PARALLELISM, BATCH_PARALLELISM))
+
+    async def analyze_one(index, filename, contents):
+        async with batch_slots:
+            try:
+                return {"index": index, "filename": filename, "openai_analysis": await analyze_image_cached_async(contents, priority="batch")}
+            except Exception as e:
+                return {"index": index, "filename": filename, "error": error_message(e)}
+
+    async def results():
+        tasks = [asyncio.create_task(analyze_one(i, name, contents)) for i, (name, contents) in enumerate(images)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# Jobs: POST /jobs answers right away with a job id; a fixed pool of workers per process works
+# through the durable queue at its own pace, so a burst of submissions reaches the model as a
+# steady stream. Poll GET /jobs/{id}, or pass a webhook to have the finished job POSTed to it.
+JOB_WORKERS = int(os.environ.get("COPILOT_JOB_WORKERS", 4))
+JOB_POLL_INTERVAL = float(os.environ.get("COPILOT_JOB_POLL_INTERVAL", 1.0))
+JOB_PRUNE_INTERVAL = 3600
+# Webhooks may only call back into these hosts
+WEBHOOK_HOSTS = set(os.environ.get("COPILOT_WEBHOOK_HOSTS", "localhost,127.0.0.1,::1").split(","))
+
+_job_queue = None
+_job_submitted = asyncio.Event()
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue.from_env()
+    return _job_queue
+
+async def notify_webhook(url, job):
+    try:
+        response = await http_client.get_async_client().post(url, json=job)
+        response.raise_for_status()
+    except (httpx.HTTPError, httpx.InvalidURL) as e:
+        metrics.log_request("job_webhook_failed", job_id=job["job_id"], error=str(e) or type(e).__name__)
+        metrics.inc("copilot_jobs_total", outcome="webhook_failed")
+
+async def run_job(queue, job):
+    metrics.observe("copilot_job_wait_seconds", time.time() - job["created"])
+    try:
+        result = {"openai_analysis": await analyze_image_cached_async(job["input"], priority="batch")}
+    except Exception as e:
+        await asyncio.to_thread(queue.fail, job["id"], error_message(e))
+        metrics.inc("copilot_jobs_total", outcome="failed")
+    else:
+        await asyncio.to_thread(queue.complete, job["id"], result)
+        metrics.inc("copilot_jobs_total", outcome="done")
+    if job["webhook"]:
+        await notify_webhook(job["webhook"], await asyncio.to_thread(queue.get, job["id"]))
+
+# A failing iteration (the queue database locked, say) is logged and the worker carries on
+# after a poll interval; a claimed job it could not finish is reclaimed once its lease runs out
+async def job_worker(queue):
+    pruned = 0
+    while True:
+        try:
+            job = await asyncio.to_thread(queue.claim)
+            if job is not None:
+                await run_job(queue, job)
+                continue
+
+            if time.time() - pruned > JOB_PRUNE_INTERVAL:
+                await asyncio.to_thread(queue.prune)
+                pruned = time.time()
+        except Exception:
+            logger.exception("job worker iteration failed")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        # Woken by a submission to this process; the timeout picks up jobs queued by other processes
+        _job_submitted.clear()
+        try:
+            await asyncio.wait_for(_job_submitted.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), webhook: str = Query(None)):
+    if webhook:
+        parsed = urlparse(webhook)
+        if parsed.scheme not in ("http", "https") or parsed.hostname not in WEBHOOK_HOSTS:
+            raise HTTPException(status_code=400, detail=f"Webhook host must be one of {sorted(WEBHOOK_HOSTS)}")
+    contents = await file.read()
+    job_id = await run_in_threadpool(get_job_queue().submit, contents, webhook)
+    _job_submitted.set()
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await run_in_threadpool(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
@@ -0,0 +1,144 @@
+"""Local stand-in for the OpenAI /v1/chat/completions endpoint.
+
+Latency, streaming speed, completion size and failure injection are tunable so the app can be
+benchmarked offline and reproducibly:
+
+    python benchmarks/mock_llm_server.py --port 8100 --ttft 0.4 --tokens-per-second 80
+    COPILOT_OPENAI_BASE_URL=http://127.0.0.1:8100/v1 streamlit run co_pilot.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("the line output stays within limits while cycle time rises slightly after the shift change and "
+         "two outliers appear near the end of the period").split()
+
+# A high-detail image at the preprocessed size is 6 tiles of 170 tokens plus 85
+IMAGE_TOKENS = 1105
+
+
+class MockSettings:
+    def __init__(self, ttft=0.3, tokens_per_second=100.0, completion_tokens=120, jitter=0.1,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, seed=None):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+
+def prompt_tokens(payload):
+    tokens = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4 + 4
+            continue
+        for part in content or []:
+            tokens += IMAGE_TOKENS if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+    return tokens
+
+
+def completion_text(payload, settings):
+    response_format = (payload.get("response_format") or {}).get("type")
+    questions = ["What is the overall trend?", "Which points are outliers?",
+                 "What is the maximum value?", "How stable is the process?"]
+    if response_format == "json_object":
+        return json.dumps({"questions": questions})
+
+    count = min(settings.completion_tokens, payload.get("max_tokens") or settings.completion_tokens)
+    text = " ".join(settings.random.choice(WORDS) for _ in range(count))
+    if response_format == "json_schema":
+        return json.dumps({"answer": text, "questions": questions})
+    return text
+
+
+def create_app(settings):
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        roll = settings.random.random()
+        if roll < settings.rate_limit_rate:
+            return JSONResponse({"error": {"message": "Rate limit reached (mock)", "type": "rate_limit"}},
+                                status_code=429, headers={"retry-after": str(settings.retry_after)})
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            return JSONResponse({"error": {"message": "Internal error (mock)", "type": "server_error"}}, status_code=500)
+
+        text = completion_text(payload, settings)
+        # Split on spaces so streamed chunks look like tokens
+        pieces = [piece + " " for piece in text.split(" ")]
+        usage = {"prompt_tokens": prompt_tokens(payload), "completion_tokens": len(pieces)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        ttft = max(0.0, settings.ttft * (1 + settings.random.uniform(-settings.jitter, settings.jitter)))
+        per_token = 1 / settings.tokens_per_second if settings.tokens_per_second else 0
+        created = int(time.time())
+        model = payload.get("model", "mock")
+
+        if not payload.get("stream"):
+            await asyncio.sleep(ttft + per_token * len(pieces))
+            return {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = (payload.get("stream_options") or {}).get("include_usage")
+
+        async def events():
+            await asyncio.sleep(ttft)
+            for piece in pieces:
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if per_token:
+                    await asyncio.sleep(per_token)
+            if include_usage:
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [], "usage": usage}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def add_arguments(parser):
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative +/- jitter applied to --ttft")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with injected 429s")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def settings_from_args(args):
+    return MockSettings(ttft=args.ttft, tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens,
+                        jitter=args.jitter, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                        retry_after=args.retry_after, seed=args.seed)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
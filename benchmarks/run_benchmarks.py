@@ -0,0 +1,257 @@
+"""End-to-end latency and throughput benchmarks, run offline against the mock model server.
+
+Drives the image encode pipeline, the FastAPI /analyze route and a scripted multi-turn
+conversation at fixed concurrency levels and reports p50/p95/p99 latency, throughput and
+peak RSS:
+
+    python benchmarks/run_benchmarks.py --concurrency 1 8 32 --json bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --max-regression 0.25
+
+With --baseline the run fails (exit status 1) when any p95 regresses by more than
+--max-regression relative to the baseline, so it can gate CI.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import uvicorn
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_llm_server
+
+FOLLOW_UP_QUESTIONS = ["What is the overall trend?", "Which points are outliers?", "What is the maximum value?",
+                       "How stable is the process?", "Compare the first and last hour."]
+
+
+def start_mock_server(settings):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(mock_llm_server.create_app(settings), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+def synthetic_chart(seed, size=(1920, 1080), fmt="PNG"):
+    """A line chart with a few series; every seed gives different bytes so caches miss."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.line([(80, 40), (80, height - 60), (width - 40, height - 60)], fill=(0, 0, 0), width=3)
+    for color in ((31, 119, 180), (255, 127, 14), (44, 160, 44)):
+        points = []
+        value = rng.uniform(0.3, 0.7)
+        for x in range(80, width - 40, max(1, width // 60)):
+            value = min(0.95, max(0.05, value + rng.uniform(-0.05, 0.05)))
+            points.append((x, 40 + (1 - value) * (height - 100)))
+        draw.line(points, fill=color, width=3)
+    data = io.BytesIO()
+    image.save(data, format=fmt)
+    return data.getvalue()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(scenario, concurrency, latencies, wall, errors, extra=None):
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(extra or {})
+    return result
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def run_threaded(scenario, concurrency, jobs):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(job) for job in jobs]:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    return summarize(scenario, concurrency, latencies, time.perf_counter() - start, errors)
+
+
+def bench_encode(core, concurrency, requests):
+    images = [synthetic_chart(i, size=(3840, 2160) if i % 2 else (1920, 1080)) for i in range(requests)]
+    return run_threaded("encode", concurrency, [lambda data=data: timed(core.encode_image, io.BytesIO(data)) for data in images])
+
+
+async def bench_analyze(api, http_client, levels, requests):
+    results = []
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for concurrency in levels:
+            images = [synthetic_chart(f"analyze-{concurrency}-{i}") for i in range(requests)]
+            slots = asyncio.Semaphore(concurrency)
+            latencies, errors = [], 0
+
+            async def one(data):
+                nonlocal errors
+                async with slots:
+                    start = time.perf_counter()
+                    response = await client.post("/analyze", files={"file": ("chart.png", data, "image/png")})
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(data) for data in images))
+            results.append(summarize("analyze", concurrency, latencies, time.perf_counter() - start, errors))
+    await http_client.close_async_client()
+    return results
+
+
+def bench_conversation(core, concurrency, conversations, turns):
+    """Initial analysis, then scripted follow-ups the way main() issues them, per conversation."""
+    first_tokens = []
+    lock = threading.Lock()
+
+    def conversation(seed):
+        image = core.prepare_image(io.BytesIO(synthetic_chart(f"conversation-{concurrency}-{seed}")))
+        history = [{"role": "user", "content": "Uploaded an image for analysis."},
+                   {"role": "assistant", "content": core.analyze_image_cached(image["key"], image["base64"])}]
+        context = core.new_conversation_context()
+        core.generate_suggestions(context.messages(history))
+
+        turn_latencies = []
+        for turn in range(turns):
+            question = FOLLOW_UP_QUESTIONS[turn % len(FOLLOW_UP_QUESTIONS)]
+            start = time.perf_counter()
+            history.append({"role": "user", "content": question})
+            context_messages = context.messages(history)
+            suggestions = core.suggestion_executor.submit(core.generate_suggestions, context_messages)
+            chunks = []
+            for delta in core.stream_chat_completion(core.follow_up_payload(context_messages, question, image["base64"]), call_site="follow_up"):
+                if not chunks:
+                    with lock:
+                        first_tokens.append(time.perf_counter() - start)
+                chunks.append(delta)
+            suggestions.result()
+            history.append({"role": "assistant", "content": "".join(chunks)})
+            turn_latencies.append(time.perf_counter() - start)
+        return turn_latencies
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(conversation, i) for i in range(conversations)]:
+            try:
+                latencies.extend(future.result())
+            except Exception:
+                errors += 1
+    return summarize("conversation_turn", concurrency, latencies, time.perf_counter() - start, errors,
+                     {"ttft_p50": percentile(first_tokens, 50), "ttft_p95": percentile(first_tokens, 95)})
+
+
+def print_table(results):
+    header = f"{'scenario':<18} {'conc':>5} {'reqs':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'rss MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        ms = lambda v: f"{v * 1000:9.1f}" if v is not None else f"{'-':>9}"
+        print(f"{r['scenario']:<18} {r['concurrency']:>5} {r['requests']:>6} {r['errors']:>4} {ms(r['p50'])} {ms(r['p95'])} {ms(r['p99'])} "
+              f"{r['throughput']:8.2f} {r['peak_rss_mb']:8.1f}")
+
+
+def compare(results, baseline, max_regression):
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    failures = []
+    for r in results:
+        before = previous.get((r["scenario"], r["concurrency"]))
+        if before and before["p95"] and r["p95"] and r["p95"] > before["p95"] * (1 + max_regression):
+            failures.append(f"{r['scenario']} @ {r['concurrency']}: p95 {before['p95'] * 1000:.1f} ms -> {r['p95'] * 1000:.1f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=["encode", "analyze", "conversation"],
+                        choices=["encode", "analyze", "conversation"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="requests per scenario and concurrency level")
+    parser.add_argument("--conversations", type=int, default=8, help="conversations per concurrency level")
+    parser.add_argument("--turns", type=int, default=5, help="follow-up questions per conversation")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results file of a previous run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    mock_llm_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(mock_llm_server.settings_from_args(args))
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["COPILOT_OPENAI_BASE_URL"] = base_url
+    os.environ["COPILOT_CACHE_DIR"] = tempfile.mkdtemp(prefix="copilot-bench-cache-")
+    import api
+    import copilot_core
+    import http_client
+
+    results = []
+    if "encode" in args.scenarios:
+        results += [bench_encode(copilot_core, c, args.requests) for c in args.concurrency]
+    if "analyze" in args.scenarios:
+        results += asyncio.run(bench_analyze(api, http_client, args.concurrency, args.requests))
+    if "conversation" in args.scenarios:
+        results += [bench_conversation(copilot_core, c, max(c, args.conversations), args.turns) for c in args.concurrency]
+    server.should_exit = True
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import re
+
+# Local, pixel-level reading of a chart: find the plot area from the axis lines, split the
+# coloured marks into series by hue and trace each series column by column. Axis labels
+# are not read, so every value is relative to the plot area: x runs from 0 (left) to 1
+# (right) and y from 0 (bottom) to 1 (top). numpy and Pillow are imported on first use.
+CHART_DATA_VERSION = 1
+MAX_SERIES = 6
+POINTS_PER_SERIES = 50
+# Width of a hue histogram bin in degrees; series closer in hue than two bins are merged
+HUE_BIN = 15
+# Larger images are scaled down first; the statistics do not need more resolution than this
+MAX_SIDE = 800
+
+# Names for describing a series in words, by the upper end of their hue range in degrees
+HUE_NAMES = [(15, "red"), (40, "orange"), (65, "yellow"), (160, "green"), (195, "cyan"),
+             (250, "blue"), (290, "purple"), (345, "pink"), (360, "red")]
+
+
+def hue_name(degrees):
+    return next(name for upper, name in HUE_NAMES if degrees < upper)
+
+
+def find_plot_area(rgb, background):
+    """(left, top, right, bottom) of the plot, bounded by the longest axis-like lines when there are any."""
+    import numpy as np
+
+    height, width, _ = rgb.shape
+    gray = rgb.mean(axis=2)
+    chroma = rgb.max(axis=2) - rgb.min(axis=2)
+    # Axes are neutral lines that contrast with the background (dark on light or light on dark)
+    line = (chroma < 60) & (np.abs(gray - background.mean()) > 80)
+
+    rows = line.sum(axis=1) * (np.arange(height) >= height * 0.4)
+    cols = line.sum(axis=0) * (np.arange(width) <= width * 0.6)
+    bottom = int(rows.argmax()) if rows.max() >= 0.4 * width else height - 1
+    left = int(cols.argmax()) if cols.max() >= 0.4 * height else 0
+
+    # The plot spans the extent of the axis lines, past their thickness
+    x_axis = line[max(0, bottom - 2):bottom + 3].any(axis=0)
+    y_axis = line[:, max(0, left - 2):left + 3].any(axis=1)
+    right = int(np.nonzero(x_axis)[0].max()) if x_axis.any() and bottom < height - 1 else width - 1
+    top = int(np.nonzero(y_axis)[0].min()) if y_axis.any() and left > 0 else 0
+    margin = 4 if left or bottom < height - 1 else 0
+    return left + margin, top, right, bottom - margin
+
+
+def hue(rgb):
+    """Hue in degrees of every pixel of an (..., 3) RGB array; 0 where there is no colour."""
+    import numpy as np
+
+    r, g, b = np.moveaxis(rgb.astype(np.float32), -1, 0)
+    high = np.maximum(np.maximum(r, g), b)
+    chroma = np.maximum(high - np.minimum(np.minimum(r, g), b), 1e-6)
+    sector = np.where(high == r, ((g - b) / chroma) % 6, np.where(high == g, (b - r) / chroma + 2, (r - g) / chroma + 4))
+    return sector * 60
+
+
+def hue_distance(a, b):
+    import numpy as np
+
+    difference = np.abs(a - b) % 360
+    return np.minimum(difference, 360 - difference)
+
+
+def rolling_median(values, window):
+    import numpy as np
+
+    half = window // 2
+    padded = np.pad(values, half, mode="edge")
+    return np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1), axis=1)
+
+
+def series_stats(x, y):
+    import numpy as np
+
+    slope = float(np.polyfit(x, y, 1)[0]) if len(x) > 1 else 0.0
+    outliers = []
+    if len(y) >= 10:
+        residual = y - rolling_median(y, max(5, len(y) // 20))
+        spread = 1.4826 * np.median(np.abs(residual - np.median(residual)))
+        flagged = np.nonzero(np.abs(residual) > max(3.5 * spread, 0.05))[0]
+        # A spike several pixels wide is one outlier, reported at its centre
+        runs = np.split(flagged, np.nonzero(np.diff(flagged) > 2)[0] + 1) if len(flagged) else []
+        outliers = [round(float(x[run].mean()), 3) for run in runs][:10]
+    low, high = int(y.argmin()), int(y.argmax())
+    return {
+        "min": {"value": round(float(y[low]), 3), "x": round(float(x[low]), 3)},
+        "max": {"value": round(float(y[high]), 3), "x": round(float(x[high]), 3)},
+        "mean": round(float(y.mean()), 3),
+        "slope": round(slope, 3),
+        "outliers": outliers,
+    }
+
+
+def extract_chart_data(image_bytes):
+    """Series found in the chart with downsampled points and summary statistics, see the module comment."""
+    import io
+
+    import numpy as np
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    scale = MAX_SIDE / max(image.size)
+    if scale < 1:
+        # Nearest-neighbour keeps thin lines in their pure colour instead of blending them into the background
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.NEAREST)
+    rgb = np.asarray(image, dtype=np.int16)
+    background = np.median(rgb.reshape(-1, 3), axis=0)
+    left, top, right, bottom = find_plot_area(rgb, background)
+    area = rgb[top:bottom + 1, left:right + 1]
+    result = {"version": CHART_DATA_VERSION, "plot_area": [left, top, right, bottom], "series": []}
+    if area.shape[0] < 10 or area.shape[1] < 10:
+        return result
+
+    # Series are the saturated colours that differ from the background
+    chroma = area.max(axis=2) - area.min(axis=2)
+    colored = (chroma > 40) & (np.abs(area - background).sum(axis=2) > 60)
+    if colored.sum() < 20:
+        return result
+
+    # Series are the peaks of the hue histogram: anti-aliasing and JPEG artifacts change a
+    # mark's lightness and saturation far more than its hue
+    hues = hue(area)
+    pixel_hues = hues[colored]
+    counts = np.bincount((pixel_hues // HUE_BIN).astype(int) % (360 // HUE_BIN), minlength=360 // HUE_BIN)
+    peaks = []
+    for peak in np.argsort(counts)[::-1]:
+        if counts[peak] < max(20, 0.05 * len(pixel_hues)) or len(peaks) == MAX_SERIES:
+            break
+        centre = (peak + 0.5) * HUE_BIN
+        if all(hue_distance(centre, other) >= 2 * HUE_BIN for other in peaks):
+            near = pixel_hues[hue_distance(pixel_hues, centre) <= HUE_BIN]
+            # Circular mean of the hues around the peak
+            radians = np.deg2rad(near)
+            peaks.append(float(np.rad2deg(np.arctan2(np.sin(radians).mean(), np.cos(radians).mean())) % 360))
+
+    if not peaks:
+        return result
+
+    # Assign each coloured pixel to the series of the nearest hue
+    distances = np.stack([hue_distance(hues, peak) for peak in peaks])
+    labels = np.where(colored & (distances.min(axis=0) <= HUE_BIN), distances.argmin(axis=0), -1)
+
+    plot_height, plot_width = labels.shape
+    for index, peak in enumerate(peaks):
+        mask = labels == index
+        present = mask.any(axis=0)
+        if present.sum() < 3:
+            continue
+        columns = np.nonzero(present)[0]
+        # The top-most pixel of each column traces lines, bars and scatter points alike
+        rows = mask[:, columns].argmax(axis=0)
+        x = columns / max(1, plot_width - 1)
+        y = 1 - rows / max(1, plot_height - 1)
+
+        bins = np.minimum((x * POINTS_PER_SERIES).astype(int), POINTS_PER_SERIES - 1)
+        counts = np.bincount(bins, minlength=POINTS_PER_SERIES)
+        filled = counts > 0
+        mean_x = np.bincount(bins, weights=x, minlength=POINTS_PER_SERIES)[filled] / counts[filled]
+        mean_y = np.bincount(bins, weights=y, minlength=POINTS_PER_SERIES)[filled] / counts[filled]
+
+        rgb_color = tuple(int(c) for c in area[mask].mean(axis=0))
+        result["series"].append(dict(
+            color="#%02x%02x%02x" % rgb_color,
+            name=hue_name(peak),
+            coverage=round(float(present.mean()), 3),
+            points=[[round(float(a), 3), round(float(b), 3)] for a, b in zip(mean_x, mean_y)],
+            **series_stats(x, y),
+        ))
+    return result
+
+
+def percent(value):
+    return f"{value * 100:.0f}%"
+
+
+def series_label(series, count):
+    return f"The {series['name']} series" if count > 1 else "The data"
+
+
+def grounding_text(chart_data):
+    """Compact description of the extracted series for the model prompt, or "" when nothing was found."""
+    if not chart_data or not chart_data["series"]:
+        return ""
+    lines = ["Measured from the chart's pixels (y as a fraction of the plot height, 0 = bottom, 1 = top; "
+             "x as a fraction of the plot width, 0 = left, 1 = right):"]
+    for i, series in enumerate(chart_data["series"], 1):
+        outliers = f", outliers at x={', '.join(str(x) for x in series['outliers'])}" if series["outliers"] else ""
+        lines.append(f"- series {i} ({series['name']}, {series['color']}, spans {percent(series['coverage'])} of the width): "
+                     f"min {series['min']['value']} at x={series['min']['x']}, max {series['max']['value']} at x={series['max']['x']}, "
+                     f"mean {series['mean']}, change {series['slope']:+} from left to right{outliers}")
+    return "\n".join(lines)
+
+
+# Questions that a relative reading of the chart answers completely, by intent. Only these
+# whole-question phrasings are answered locally; anything else ("which machine has the
+# highest scrap rate?", "what caused the peak?") goes to the model.
+_ASK = r"(?:(?:what|where) (?:is|are) )?(?:the )?(?:overall )?"
+_ON = r"(?: points?)?(?: (?:of|in|on) (?:the|this) (?:chart|graph|data|plot|lines?|series))?"
+LOCAL_INTENTS = {
+    "max": re.compile(_ASK + r"(?:max|maximum|highest point|peak)" + _ON),
+    "min": re.compile(_ASK + r"(?:min|minimum|lowest point)" + _ON),
+    "mean": re.compile(_ASK + r"(?:average|mean)" + _ON),
+    "trend": re.compile(_ASK + r"trend" + _ON + r"|is (?:it|the data|the line) (?:trending|going) (?:up|down)"
+                        r"|is (?:it|the data|the line) (?:increasing|decreasing)"),
+    "outliers": re.compile(r"(?:are there )?(?:any )?(?:outliers|anomalies|spikes)" + _ON),
+    "series": re.compile(r"how many (?:series|lines)(?: are there)?" + _ON),
+}
+LOCAL_ANSWER_NOTE = "_Read directly from the chart's pixels: positions are relative to the plot area, not axis values._"
+
+
+def answer_locally(chart_data, question):
+    """Answer a short question about a single statistic from the extracted data, or None to ask the model."""
+    if not chart_data or not chart_data["series"]:
+        return None
+    question = " ".join(question.lower().replace("what's", "what is").replace("where's", "where is").split()).rstrip("?!. ")
+    intents = [intent for intent, pattern in LOCAL_INTENTS.items() if pattern.fullmatch(question)]
+    if not intents:
+        return None
+
+    intent = intents[0]
+    series_list = chart_data["series"]
+    count = len(series_list)
+    if intent == "series":
+        names = ", ".join(series["name"] for series in series_list)
+        return f"The chart shows {count} data series ({names}).\n\n{LOCAL_ANSWER_NOTE}"
+
+    lines = []
+    for series in series_list:
+        label = series_label(series, count)
+        if intent in ("max", "min"):
+            point = series[intent]
+            word = "peaks" if intent == "max" else "bottoms out"
+            lines.append(f"{label} {word} at {percent(point['value'])} of the plot height, "
+                         f"{percent(point['x'])} of the way along the x-axis.")
+        elif intent == "mean":
+            lines.append(f"{label} averages {percent(series['mean'])} of the plot height.")
+        elif intent == "trend":
+            slope = series["slope"]
+            direction = "rises" if slope > 0.05 else "falls" if slope < -0.05 else "stays roughly flat"
+            lines.append(f"{label} {direction} overall ({slope * 100:+.0f}% of the plot height from left to right).")
+        elif series["outliers"]:
+            positions = ", ".join(percent(x) for x in series["outliers"])
+            lines.append(f"{label} has {len(series['outliers'])} outlier(s), at {positions} along the x-axis.")
+        else:
+            lines.append(f"{label} has no clear outliers.")
+    return "\n\n".join(lines + [LOCAL_ANSWER_NOTE])
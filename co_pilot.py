@@ -1,120 +1,55 @@
 import base64
-import requests
-import streamlit as st
-import streamlit.components.v1 as components
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import HTMLResponse
-from io import BytesIO
-from PIL import Image
-import io
 import os
-import json
-
-# Initialize FastAPI app
-app = FastAPI()
-
-openai_key = os.environ['OPENAI_API_KEY']
-
-def analyze_image_openai(base64_image):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_key}"
-    }
-    message_list = [
-        {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}"
-            }
-        },
-        {
-            "type": "text",
-            "text": f"""
-            You are an expert graph interpreter with deep expertise in the manufacturing domain, including machines, processes, production systems, control systems (PLCs), 
-            firmware, and part types (both discrete and continuous production).
-
-            1. **Overview:**
-            - Summarize the brief overview of the graph image from the data visualized in this graph along with the type of graph. Provide a summary that would make sense to
-              someone with no technical or domain knowledge, explaining what the graph represents and any important conclusions.
-
-            2. **Insights:**
-            - Thinking from the people working in the manufacturing line, include necessary information for them based on the type of graph.
-            - Analyze whether the trend in the data shows a general increase, decrease, or stability.
-            - Identify any outliers and explain how they differ from the rest of the data.
-            - If the graph is a scatter plot, describe the relationship between the two variables, noting any correlation and its implications.
-            - Feel free to use variance, outliers, similarities, trends, comparisons to better understand the context.
-            - Feel free to provide supporting numbers, etc.
-    
-
-            Generate the output in a concise format of 2-4 short paragraphs.Highlight important numbers using bold, italic.".
-            """
-        }
-    ]
-
-    payload = {
-        "model": "gpt-4o",
-        "messages": [
-            {
-                "role": "user",
-                "content": message_list
-            }
-        ],
-        "max_tokens": 1024
-    }
-
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-    return response.json()['choices'][0]['message']['content']
-
-def generate_suggestion(messages):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_key}"
-    }
-
-    messages.append({
-            "role": "user",
-            "content": "Strictly give the response only in JSON format containing a list of 4 questions based on the image. Sample response: '{'questions':['What is the image?']}'.Strictly enforce the json format without any descriptions"
-        })
-
-    payload = {
-        "model": "gpt-4o",
-        "messages": messages,
-        "max_tokens": 1024
-    }
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-    return response.json()['choices'][0]['message']['content']
-
-# Function to convert any image format to JPEG
-def convert_to_jpeg(image_file):
-    image = Image.open(image_file)
-    if image.mode in ("RGBA", "P"):
-        image = image.convert("RGB")
-    
-    jpeg_image = io.BytesIO()
-    image.save(jpeg_image, format="JPEG")
-    jpeg_image.seek(0)
-    return jpeg_image
-
-# Encode the image to base64
-def encode_image(image_file):
-    jpeg_image = convert_to_jpeg(image_file)
-    return base64.b64encode(jpeg_image.read()).decode('utf-8')
-
-def decode_image(base64_image):
-    image_data = base64.b64decode(base64_image)
-    return Image.open(io.BytesIO(image_data))
-
-@app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...)):
-    contents = await file.read()
-    base64_image = base64.b64encode(contents).decode('utf-8')
-    
-    openai_analysis = analyze_image_openai(base64_image)
-    return {"openai_analysis": openai_analysis}
+import threading
+import uuid
+from io import BytesIO
 
 import streamlit as st
-import time
-import requests
+import streamlit.components.v1 as components
+
+import example_charts
+import metrics
+import session_store
+from copilot_core import (
+    FOLLOW_UP_MODE,
+    MAX_PAGES,
+    accept_similar_analysis,
+    analysis_key,
+    analyze_image_cached,
+    analyze_image_cached_stream,
+    analyze_pages,
+    answer_from_chart_data,
+    answer_with_suggestions,
+    chat_completion,
+    example_version,
+    find_similar_analysis,
+    follow_up_payload,
+    follow_up_scope,
+    generate_suggestions,
+    get_analysis_cache,
+    index_fingerprint,
+    lookup_answer,
+    new_conversation_context,
+    page_count,
+    precompute_example,
+    prepare_image,
+    store_answer,
+    stream_chat_completion,
+    stream_suggestions,
+    suggestion_executor,
+    summarize_pages,
+)
+
+# Streamlit UI entry point: streamlit run co_pilot.py
+# The API server lives in api.py; `co_pilot:app` still resolves to it for existing deployments.
+def __getattr__(name):
+    if name == "app":
+        from api import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Stream tokens into the chat as they arrive instead of waiting for the full completion
+STREAM_RESPONSES = os.environ.get("COPILOT_STREAM", "1") != "0"
 
 def set_custom_css():
     st.markdown("""
@@ -200,7 +135,7 @@ def set_name(name):
     st.session_state.button_state = name
     
 def display_suggestions(suggestions):
-    """Render suggestion buttons."""
+    """Render suggestion buttons; given a generator, each button appears as soon as its question arrives."""
     
     # st.markdown("""
     # <style>
@@ -211,12 +146,108 @@ def display_suggestions(suggestions):
     # }
     # </style>
     # """, unsafe_allow_html=True)
-    if suggestions:
-        # st.markdown("### Suggestions:")
-        cols = st.columns(len(suggestions))
-        for i, suggestion in enumerate(suggestions):
-            if cols[i].button(suggestion, key=i, on_click=set_name, args=[suggestion]):
-                st.session_state['button_state']=suggestion
+    if isinstance(suggestions, list) and not suggestions:
+        return
+    # st.markdown("### Suggestions:")
+    cols = st.columns(len(suggestions) if isinstance(suggestions, list) else 4)
+    for i, suggestion in enumerate(suggestions):
+        if cols[i].button(suggestion, key=i, on_click=set_name, args=[suggestion]):
+            st.session_state['button_state']=suggestion
+
+# Conversations and their images live in a bounded store shared by all sessions of this process
+# (COPILOT_SESSION_STORE=memory|sqlite) instead of st.session_state
+@st.cache_resource
+def get_session_store():
+    return session_store.session_store_from_env()
+
+def session_messages():
+    return get_session_store().messages(st.session_state['session_id'])
+
+def add_message(role, content, image=None):
+    get_session_store().append_message(st.session_state['session_id'], role, content, image=image)
+
+# Keyed on the bundled files' modification times, so examples bundled by the build step after
+# the app started are picked up on the next rerun instead of staying disabled
+@st.cache_resource(max_entries=1)
+def load_examples(bundle_stamp):
+    """Bundled example charts, loaded once per bundle with their precomputed answers seeded into the analysis cache."""
+    examples = example_charts.load_examples(example_version)
+    for example in examples.values():
+        if example["analysis"]:
+            get_analysis_cache().set(analysis_key(example["bytes"]), example["analysis"])
+
+    stale = [name for name, example in examples.items() if example["analysis"] is None]
+    if stale:
+        def refresh():
+            precomputed = example_charts.precompute_examples(example_version, precompute_example, stale)
+            for name in stale:
+                if name in precomputed:
+                    examples[name].update(analysis=precomputed[name]["analysis"], suggestions=precomputed[name]["suggestions"])
+        threading.Thread(target=refresh, daemon=True).start()
+    return examples
+
+def image_base64():
+    jpeg_bytes = get_session_store().get_image(st.session_state['image']["jpeg"])
+    return base64.b64encode(jpeg_bytes).decode('utf-8') if jpeg_bytes is not None else None
+
+def choose_similar(choice):
+    st.session_state['similar']["choice"] = choice
+
+def finish_initial_analysis(openai_analysis):
+    add_message("assistant", openai_analysis)
+    st.session_state['initial_analysis_done'] = True
+    st.session_state['similar'] = None
+    # The store holds the image from here on; don't keep a second copy of the example bytes
+    st.session_state['uploaded_file'] = None
+    # update_sidebar_summary()  # Update the sidebar immediately after response
+
+def run_initial_analysis(base64_image):
+    image = st.session_state['image']
+    with st.chat_message("assistant"):
+        if STREAM_RESPONSES:
+            openai_analysis = st.write_stream(analyze_image_cached_stream(image["key"], base64_image))
+        else:
+            openai_analysis = analyze_image_cached(image["key"], base64_image)
+            st.write(openai_analysis)
+    index_fingerprint(image["key"], image["fingerprint"])
+    finish_initial_analysis(openai_analysis)
+
+# Multi-page reports: every page is analyzed on its own and shown as soon as it is done, then
+# the pages are summarized together. Follow-up questions see the first page's image and the
+# text of every page's analysis.
+PAGE_SUMMARY = os.environ.get("COPILOT_PAGE_SUMMARY", "1") != "0"
+
+def run_page_analysis(image_bytes, pages):
+    analyses = {}
+    with st.chat_message("assistant"):
+        if pages > MAX_PAGES:
+            st.write(f"This report has {pages} pages; only the first {MAX_PAGES} are analyzed.")
+        progress = st.progress(0.0, text=f"Analyzing {min(pages, MAX_PAGES)} pages...")
+        for result in analyze_pages(image_bytes, pages):
+            analyses[result["page"]] = result.get("openai_analysis") or f"Could not analyze this page: {result['error']}"
+            st.markdown(f"**Page {result['page']} of {pages}**\n\n{analyses[result['page']]}")
+            progress.progress(len(analyses) / min(pages, MAX_PAGES), text=f"Analyzed {len(analyses)} of {min(pages, MAX_PAGES)} pages")
+        progress.empty()
+        ordered = sorted(analyses.items())
+        openai_analysis = "\n\n".join(f"**Page {page} of {pages}**\n\n{analysis}" for page, analysis in ordered)
+        if PAGE_SUMMARY and len(ordered) > 1:
+            try:
+                with st.spinner("Summarizing the report..."):
+                    summary = summarize_pages(ordered)
+            except Exception as e:
+                # Keep the page analyses; the summary is only a convenience on top
+                st.warning(f"Could not summarize the report: {e}")
+            else:
+                st.markdown(f"**Summary**\n\n{summary}")
+                openai_analysis += f"\n\n**Summary**\n\n{summary}"
+    finish_initial_analysis(openai_analysis)
+
+def start_example(example):
+    st.session_state['initial_analysis_done'] = False
+    st.session_state['uploaded_file'] = BytesIO(example["bytes"])
+    st.session_state['suggestion_state'] = None
+    st.session_state['example_suggestions'] = example["suggestions"]
+    st.session_state['similar'] = None
 
 # Main function to handle the Streamlit app logic
 def main():
@@ -234,13 +265,25 @@ def main():
 
     if 'suggestion_state' not in st.session_state:
         st.session_state['suggestion_state'] = None
+
+    # Token-budgeted view of the history that is sent with follow-ups and suggestion requests
+    if 'context' not in st.session_state:
+        st.session_state['context'] = new_conversation_context()
     
     if 'uploaded_file' not in st.session_state:
         st.session_state['uploaded_file'] = None
 
-    # Initialize session states for messages and analysis flag if not already done
-    if 'messages' not in st.session_state:
-        st.session_state['messages'] = []
+    # Hashes of the current conversation's image in the session store, see prepare_image
+    if 'image' not in st.session_state:
+        st.session_state['image'] = None
+
+    # Near-duplicate analysis offered for the current upload, see find_similar_analysis
+    if 'similar' not in st.session_state:
+        st.session_state['similar'] = None
+
+    # Messages are kept in the session store under this id
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
 
     if 'initial_analysis_done' not in st.session_state:
         st.session_state['initial_analysis_done'] = False
@@ -285,72 +328,86 @@ def main():
     </p>
     """, unsafe_allow_html=True)
 
-    uploaded_file = st.file_uploader("Upload a graph", type=["jpg", "jpeg", "png", "bmp", "tiff"], label_visibility="hidden")
+    uploaded_file = st.file_uploader("Upload a graph", type=["jpg", "jpeg", "png", "bmp", "tiff", "tif"], label_visibility="hidden")
 
     col1, col2, col3 = st.columns([1, 6, 1])
 
-    with col1:
-        # with example_col:
-        try_example1 = st.button("Try Example 1", key="Example 1")
-        if try_example1:
-            example_image_path = "https://drive.google.com/uc?export=download&id=1eIvWFmIbHnn0Obco7QUaQq3SMfGu_fGD"
-            response = requests.get(example_image_path)
-            if response.status_code == 200:
-                uploaded_file = BytesIO(response.content)
-                # uploaded_file = convert_to_uploaded_file(BytesIO(response.content), name="example.jpg", type="image/jpeg")
-                st.session_state['initial_analysis_done'] = False
-                st.session_state['uploaded_file'] = uploaded_file
-    with col2:
-        try_example2 = st.button("Try Example 2", key="Example 2")
-        if try_example2:
-            example_image_path = "https://drive.google.com/uc?export=download&id=1aBT4HC3o-2syyZ3ewSBSRcJCAUjuMvpm"
-            response = requests.get(example_image_path)
-            if response.status_code == 200:
-                uploaded_file = BytesIO(response.content)
-                # uploaded_file = convert_to_uploaded_file(BytesIO(response.content), name="example.jpg", type="image/jpeg")
-                st.session_state['initial_analysis_done'] = False
-                st.session_state['uploaded_file'] = uploaded_file
+    examples = load_examples(example_charts.bundle_stamp())
+    for column, name in zip([col1, col2], example_charts.EXAMPLES):
+        with column:
+            example = examples.get(name)
+            label = example_charts.EXAMPLES[name]["label"]
+            if st.button(label, key=label.replace("Try ", ""), disabled=example is None,
+                         help=None if example else "Run `python example_charts.py` to bundle this example"):
+                start_example(example)
 
     if st.session_state['uploaded_file']:
         uploaded_file = st.session_state['uploaded_file']
 
-    if uploaded_file is not None and not st.session_state['initial_analysis_done']:
-        base64_image = encode_image(uploaded_file)
-        openai_analysis = analyze_image_openai(base64_image)
-
-        st.session_state['messages'].append({
-            "role": "user",
-            "content": "Uploaded an image for analysis.",
-            "image": base64_image
-        })
-        
-        st.session_state['messages'].append({
-            "role": "assistant",
-            "content": openai_analysis
-        })
-
-        st.session_state['initial_analysis_done'] = True
-        # update_sidebar_summary()  # Update the sidebar immediately after response
-
     # Display the conversation
-    for message in st.session_state['messages']:
-        with st.chat_message(message["role"]):
-            if "image" in message:
-                st.image(decode_image(message["image"]), width=400)
-            st.write(message["content"])
+    with metrics.stage("render_history"):
+        for message in session_messages():
+            with st.chat_message(message["role"]):
+                thumbnail = get_session_store().get_image(message["image"]) if "image" in message else None
+                if thumbnail:
+                    st.image(thumbnail, width=400)
+                st.write(message["content"])
+
+    if uploaded_file is not None and not st.session_state['initial_analysis_done'] and not st.session_state['similar']:
+        try:
+            image = prepare_image(uploaded_file)
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
+        st.session_state['image'] = {
+            "key": image["key"],
+            "jpeg": get_session_store().put_image(st.session_state['session_id'], image["jpeg"]),
+            "fingerprint": image["fingerprint"],
+            "chart_data": image["chart_data"]
+        }
 
+        add_message("user", "Uploaded an image for analysis.", image=image["thumbnail"])
+
+        with st.chat_message("user"):
+            st.image(image["thumbnail"], width=400)
+            st.write("Uploaded an image for analysis.")
+
+        pages = page_count(uploaded_file.getvalue())
+        similar = find_similar_analysis(image["key"], image["fingerprint"]) if pages == 1 else None
+        if pages > 1:
+            run_page_analysis(uploaded_file.getvalue(), pages)
+        elif similar:
+            st.session_state['similar'] = dict(similar, choice=None)
+        else:
+            run_initial_analysis(image["base64"])
+
+    # A near-duplicate of this chart was analyzed before; let the user pick reuse or a fresh analysis
+    similar = st.session_state['similar']
+    if similar and not st.session_state['initial_analysis_done']:
+        if similar["choice"] is None:
+            with st.chat_message("assistant"):
+                st.write("This chart looks almost identical to one analyzed before. Use that analysis, or analyze this chart from scratch?")
+                col1, col2 = st.columns(2)
+                col1.button("Use previous analysis", on_click=choose_similar, args=["accept"])
+                col2.button("Analyze this chart", on_click=choose_similar, args=["analyze"])
+            st.stop()
+
+        if similar["choice"] == "accept":
+            image = st.session_state['image']
+            accept_similar_analysis(image["key"], image["fingerprint"], similar["analysis"])
+            with st.chat_message("assistant"):
+                st.write(similar["analysis"])
+            finish_initial_analysis(similar["analysis"])
+        else:
+            run_initial_analysis(image_base64())
 
     # Show the follow-up question input only after the first assistant response
     if st.session_state['initial_analysis_done']:
 
         if not st.session_state['suggestion_state']:
-            suggestion_response = generate_suggestion(st.session_state['messages'].copy())
-            # print(suggestion_response[8:len(suggestion_response)-3])
-            if suggestion_response[0] != "{":
-                suggestion_dict = json.loads(suggestion_response[8:len(suggestion_response)-3])
-            else:
-                suggestion_dict = json.loads(suggestion_response)
-            suggestions = suggestion_dict["questions"]
+            suggestions = st.session_state.pop('example_suggestions', None)
+            if not suggestions:
+                suggestions = stream_suggestions(st.session_state['context'].messages(session_messages()))
             display_suggestions(suggestions)
             st.session_state['suggestion_state'] = "Done"
 
@@ -362,75 +419,51 @@ def main():
             st.session_state.button_state = None
 
         if user_query:
-            st.session_state['messages'].append({
-                "role": "user",
-                "content": user_query
-            })
+            base64_image = image_base64()
+            if base64_image is None:
+                st.warning("This conversation has expired. Please upload the graph again.")
+                st.stop()
+
+            add_message("user", user_query)
 
             with st.chat_message("user"):
                 st.write(user_query)
 
-            assistant_placeholder = st.empty()
-
-            with assistant_placeholder.chat_message("assistant"):
-                typing_placeholder = st.empty()
-                typing_placeholder.write("Linecraft co-pilot is typing...")
-
-            context_messages = [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state['messages']]
-            base64_image = encode_image(uploaded_file)
-            relevance_check_prompt = f"""Answer the given user query based on previous response and graph uploaded
-            User query:"{user_query}"
-            In the output highlight specific data points that helps making insights useful .
-            """
-
-            payload = {
-                "model": "gpt-4o",
-                "messages": context_messages + [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": relevance_check_prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ],"max_tokens": 1024
-            }
-
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {openai_key}"
-            }
-
-            time.sleep(2)
-
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            ai_response = response.json()['choices'][0]['message']['content']
-
-            assistant_placeholder.empty()
-
-            st.session_state['messages'].append({
-                "role": "assistant",
-                "content": ai_response
-            })
+            chart_data = st.session_state['image'].get("chart_data")
+            context_messages = st.session_state['context'].messages(session_messages())
+            payload = follow_up_payload(context_messages, user_query, base64_image, chart_data)
+            # Everything before the question itself, which is the last context message
+            answer_scope = follow_up_scope(st.session_state['image']["key"], context_messages[:-1])
+            cached = lookup_answer(answer_scope, user_query)
+            local_answer = None if cached else answer_from_chart_data(chart_data, user_query)
 
             with st.chat_message("assistant"):
-                st.write(ai_response)
+                if cached:
+                    ai_response, suggestions = cached["answer"], cached["suggestions"]
+                    st.write(ai_response)
+                elif local_answer:
+                    # Answered from the chart data: only the suggestions need the model
+                    ai_response = local_answer
+                    st.write(ai_response)
+                    suggestions = stream_suggestions(context_messages)
+                elif FOLLOW_UP_MODE == "structured":
+                    with st.spinner("Linecraft co-pilot is typing..."):
+                        ai_response, suggestions = answer_with_suggestions(payload)
+                    st.write(ai_response)
+                else:
+                    suggestions_future = suggestion_executor.submit(generate_suggestions, context_messages)
+                    if STREAM_RESPONSES:
+                        ai_response = st.write_stream(stream_chat_completion(payload, call_site="follow_up"))
+                    else:
+                        with st.spinner("Linecraft co-pilot is typing..."):
+                            ai_response = chat_completion(payload, call_site="follow_up")
+                        st.write(ai_response)
+                    suggestions = suggestions_future.result()
+                if not cached and not local_answer:
+                    store_answer(answer_scope, user_query, ai_response, suggestions)
+
+            add_message("assistant", ai_response)
 
-            suggestion_response = generate_suggestion(st.session_state['messages'].copy())
-            # print(suggestion_response[8:len(suggestion_response)-3])
-            if suggestion_response[0] != "{":
-                suggestion_dict = json.loads(suggestion_response[8:len(suggestion_response)-3])
-            else:
-                suggestion_dict = json.loads(suggestion_response)
-            suggestions = suggestion_dict["questions"]
             display_suggestions(suggestions)
             # st.session_state['suggestion_state'] = "Done"
             # display_suggestions(suggestions)
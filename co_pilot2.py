@@ -4,19 +4,22 @@ import base64
 import requests
 import streamlit as st
 import streamlit.components.v1 as components
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import HTMLResponse
 from io import BytesIO
 
-# Initialize FastAPI app
-app = FastAPI()
+# Streamlit UI only; the API server lives in api.py and `co_pilot2:app` resolves to it
+def __getattr__(name):
+    if name == "app":
+        from api import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # OpenAI and Anthropic API keys
 import os
 # os.environ['REQUESTS_CA_BUNDLE'] = r"C:\Users\nikhils\Downloads\Zscaler Root CA.crt"
 # os.environ["OPENAI_API_KEY"] = openai_key
-openai_key = os.environ["OPENAI_API_KEY"] 
 def analyze_image_openai(base64_image):
+    # Read at call time so importing this module does not require the key
+    openai_key = os.environ["OPENAI_API_KEY"]
     headers = {
     "Content-Type": "application/json",
     "Authorization": f"Bearer {openai_key}"
@@ -87,15 +90,6 @@ def encode_image(image_file):
     return base64.b64encode(jpeg_image.read()).decode('utf-8')
 
 
-@app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...)):
-    contents = await file.read()
-    base64_image = base64.b64encode(contents).decode('utf-8')
-    
-    openai_analysis = analyze_image_openai(base64_image)
-    return {"openai_analysis": openai_analysis}
-
-
 import streamlit as st
 from PIL import Image
 import base64
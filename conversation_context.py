@@ -0,0 +1,74 @@
+_encodings = {}
+_tiktoken = False
+
+# tiktoken is optional and slow to import, so it is loaded on the first count
+def load_tiktoken():
+    global _tiktoken
+    if _tiktoken is False:
+        try:
+            import tiktoken
+        except ImportError:
+            tiktoken = None
+        _tiktoken = tiktoken
+    return _tiktoken
+
+# Token count of a chat message; exact with tiktoken installed, ~4 characters per token otherwise
+def count_tokens(message, model="gpt-4o"):
+    content = message["content"]
+    if not isinstance(content, str):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+    tiktoken = load_tiktoken()
+    if tiktoken is None:
+        return 4 + (len(content) + 3) // 4
+
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return 4 + len(_encodings[model].encode(content))
+
+
+# Keeps the history sent with each follow-up under a token budget. The most recent turns are
+# sent verbatim; once they no longer fit, the oldest ones are folded into a running summary
+# by the summarize callback (previous summary, messages to fold) -> new summary.
+# Messages may carry an "id" (see session_store); folding then tracks ids rather than list
+# positions, so a history whose oldest messages were trimmed by the store keeps lining up.
+class ConversationContext:
+    def __init__(self, summarize, token_budget=4000, keep_recent=4, model="gpt-4o"):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.model = model
+        self.summary = ""
+        self.folded = 0
+
+    def _summary_message(self):
+        return {"role": "system", "content": f"Summary of the earlier conversation about this graph:\n{self.summary}"}
+
+    def messages(self, history):
+        """Messages to send for the given history: the running summary followed by recent turns."""
+        indexed = [(msg.get("id", i), {"role": msg["role"], "content": msg["content"]}) for i, msg in enumerate(history)]
+        indexed = [(msg_id, msg) for msg_id, msg in indexed if msg_id >= self.folded]
+        recent = [msg for _, msg in indexed]
+        sizes = [count_tokens(msg, self.model) for msg in recent]
+        summary_size = count_tokens(self._summary_message(), self.model) if self.summary else 0
+
+        fold = 0
+        while len(recent) - fold > self.keep_recent and summary_size + sum(sizes[fold:]) > self.token_budget:
+            fold += 1
+
+        if fold:
+            try:
+                self.summary = self.summarize(self.summary, recent[:fold])
+            except Exception:
+                # Without a fresh summary the folded turns are simply dropped, which still
+                # keeps the request inside the budget
+                pass
+            self.folded = indexed[fold - 1][0] + 1
+            recent = recent[fold:]
+
+        if self.summary:
+            return [self._summary_message()] + recent
+        return recent
@@ -0,0 +1,855 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import http_client
+import metrics
+from analysis_cache import AnalysisCache
+from answer_cache import AnswerCache
+from chart_data import CHART_DATA_VERSION, answer_locally, extract_chart_data, grounding_text
+from conversation_context import ConversationContext
+from image_fingerprint import FingerprintIndex, dhash
+from image_pool import ImagePool
+from suggestion_parser import SuggestionParser
+
+# Core chart analysis library shared by the API server (api.py), the Streamlit UI (co_pilot.py)
+# and the tooling. It imports neither FastAPI nor Streamlit, and Pillow only when an image is
+# actually processed, so every entry point pays only for what it uses.
+
+# Model routing per call site: model, max_tokens and (optionally) temperature, plus a cascade of
+# models to escalate to, in order, when a response fails validation (see cascade_completion).
+# COPILOT_MODEL_ROUTES takes a JSON object that is merged over these per call site, e.g.
+#   {"suggestions": {"model": "gpt-4o-mini", "cascade": []}, "follow_up": {"temperature": 0.2}}
+MODEL_ROUTES = {
+    "analysis": {"model": "gpt-4o", "max_tokens": 1024},
+    "follow_up": {"model": "gpt-4o", "max_tokens": 1024},
+    "suggestions": {"model": os.environ.get("COPILOT_SUGGESTION_MODEL", "gpt-4o-mini"), "max_tokens": 256, "cascade": ["gpt-4o"]},
+    "summary": {"model": os.environ.get("COPILOT_SUMMARY_MODEL", "gpt-4o-mini"), "max_tokens": 512},
+    "report_summary": {"model": os.environ.get("COPILOT_SUMMARY_MODEL", "gpt-4o-mini"), "max_tokens": 1024},
+}
+for call_site, overrides in json.loads(os.environ.get("COPILOT_MODEL_ROUTES") or "{}").items():
+    MODEL_ROUTES[call_site] = dict(MODEL_ROUTES.get(call_site, {}), **overrides)
+
+def route_payload(call_site, payload, model=None):
+    """payload with the model, max_tokens and temperature of the call site's route."""
+    route = MODEL_ROUTES[call_site]
+    payload = dict(payload, model=model or route["model"], max_tokens=route["max_tokens"])
+    if route.get("temperature") is not None:
+        payload["temperature"] = route["temperature"]
+    return payload
+
+ANALYSIS_MODEL = MODEL_ROUTES["analysis"]["model"]
+ANALYSIS_PROMPT = """
+            You are an expert graph interpreter with deep expertise in the manufacturing domain, including machines, processes, production systems, control systems (PLCs), 
+            firmware, and part types (both discrete and continuous production).
+
+            1. **Overview:**
+            - Summarize the brief overview of the graph image from the data visualized in this graph along with the type of graph. Provide a summary that would make sense to
+              someone with no technical or domain knowledge, explaining what the graph represents and any important conclusions.
+
+            2. **Insights:**
+            - Thinking from the people working in the manufacturing line, include necessary information for them based on the type of graph.
+            - Analyze whether the trend in the data shows a general increase, decrease, or stability.
+            - Identify any outliers and explain how they differ from the rest of the data.
+            - If the graph is a scatter plot, describe the relationship between the two variables, noting any correlation and its implications.
+            - Feel free to use variance, outliers, similarities, trends, comparisons to better understand the context.
+            - Feel free to provide supporting numbers, etc.
+    
+
+            Generate the output in a concise format of 2-4 short paragraphs.Highlight important numbers using bold, italic.".
+            """
+
+# Shared between /analyze and the Streamlit app; keyed on image bytes + model + prompt.
+# Created on first use so importing this module does no I/O.
+_analysis_cache = None
+
+def get_analysis_cache():
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache.from_env()
+    return _analysis_cache
+
+# Point this at benchmarks/mock_llm_server.py (or any compatible gateway) to run without OpenAI
+OPENAI_BASE_URL = os.environ.get("COPILOT_OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_CHAT_URL = f"{OPENAI_BASE_URL.rstrip('/')}/chat/completions"
+
+# The key is read when the first request is made, not at import, so entry points that never
+# call the model (tooling, health checks) start without it
+def openai_headers():
+    openai_key = os.environ.get("OPENAI_API_KEY")
+    if not openai_key:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {openai_key}"
+    }
+
+# Record timing, outcome and token usage of one model call
+def record_upstream(call_site, payload, start, usage=None, outcome="ok", first_token=None):
+    elapsed = time.perf_counter() - start
+    metrics.observe("copilot_upstream_duration_seconds", elapsed, call_site=call_site)
+    metrics.inc("copilot_upstream_requests_total", call_site=call_site, model=payload.get("model"), outcome=outcome)
+    metrics.record_usage(call_site, usage)
+    if first_token is not None:
+        metrics.observe("copilot_time_to_first_token_seconds", first_token - start, call_site=call_site)
+    metrics.log_request("model_call", call_site=call_site, model=payload.get("model"), outcome=outcome,
+                        seconds=round(elapsed, 4), usage=usage)
+
+# Parse one server-sent event line of a streamed completion into (delta, usage, done)
+def parse_stream_line(line):
+    if not line or not line.startswith("data:"):
+        return None, None, False
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None, None, True
+    chunk = json.loads(data)
+    choices = chunk.get("choices")
+    delta = choices[0].get("delta", {}).get("content") if choices else None
+    return delta, chunk.get("usage"), False
+
+# Scheduling class of each call site (see http_client.PRIORITIES): what the user is waiting on
+# right now goes first, bulk work last
+CALL_SITE_PRIORITY = {"follow_up": "interactive", "summary": "interactive", "analysis": "analysis",
+                      "report_summary": "analysis", "suggestions": "suggestions"}
+
+def call_priority(call_site, priority=None):
+    return priority or CALL_SITE_PRIORITY.get(call_site, "interactive")
+
+def chat_completion(payload, call_site="chat", priority=None, deadline=None):
+    start = time.perf_counter()
+    try:
+        with http_client.scheduler.slot(call_priority(call_site, priority), deadline, tokens=http_client.estimate_tokens(payload)):
+            body = http_client.post_json(OPENAI_CHAT_URL, payload, openai_headers()).json()
+        content = body['choices'][0]['message']['content']
+    except Exception:
+        record_upstream(call_site, payload, start, outcome="error")
+        raise
+    record_upstream(call_site, payload, start, body.get("usage"))
+    return content
+
+# Yield the content deltas of a streamed (server-sent events) chat completion
+def stream_chat_completion(payload, call_site="chat", priority=None, deadline=None):
+    payload = dict(payload, stream=True, stream_options={"include_usage": True})
+    start = time.perf_counter()
+    first_token = usage = None
+    outcome = "error"
+    try:
+        with http_client.scheduler.slot(call_priority(call_site, priority), deadline, tokens=http_client.estimate_tokens(payload)), \
+                http_client.post_json(OPENAI_CHAT_URL, payload, openai_headers(), stream=True) as response:
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                delta, chunk_usage, done = parse_stream_line(line)
+                usage = chunk_usage or usage
+                if done:
+                    break
+                if delta:
+                    first_token = first_token or time.perf_counter()
+                    yield delta
+        outcome = "ok"
+    finally:
+        record_upstream(call_site, payload, start, usage, outcome, first_token)
+
+# Async counterparts for the API server, scheduled with the same priorities
+async def chat_completion_async(payload, call_site="chat", priority=None, deadline=None):
+    start = time.perf_counter()
+    try:
+        async with http_client.scheduler.slot_async(call_priority(call_site, priority), deadline, tokens=http_client.estimate_tokens(payload)):
+            response = await http_client.post_json_async(OPENAI_CHAT_URL, payload, openai_headers())
+        body = response.json()
+        content = body['choices'][0]['message']['content']
+    except Exception:
+        record_upstream(call_site, payload, start, outcome="error")
+        raise
+    record_upstream(call_site, payload, start, body.get("usage"))
+    return content
+
+async def stream_chat_completion_async(payload, call_site="chat", priority=None):
+    payload = dict(payload, stream=True, stream_options={"include_usage": True})
+    start = time.perf_counter()
+    first_token = usage = None
+    outcome = "error"
+    try:
+        async with http_client.scheduler.slot_async(call_priority(call_site, priority), tokens=http_client.estimate_tokens(payload)):
+            response = await http_client.post_json_async(OPENAI_CHAT_URL, payload, openai_headers(), stream=True)
+            try:
+                async for line in response.aiter_lines():
+                    delta, chunk_usage, done = parse_stream_line(line)
+                    usage = chunk_usage or usage
+                    if done:
+                        break
+                    if delta:
+                        first_token = first_token or time.perf_counter()
+                        yield delta
+            finally:
+                await response.aclose()
+        outcome = "ok"
+    finally:
+        record_upstream(call_site, payload, start, usage, outcome, first_token)
+
+# Try the call site's model first and escalate along its cascade while validate(content) is
+# falsy; the last model's answer is returned either way. Every step is counted per model.
+def cascade_models(payload, call_site):
+    return [payload["model"]] + [model for model in MODEL_ROUTES[call_site].get("cascade", []) if model != payload["model"]]
+
+def cascade_completion(payload, call_site, validate, deadline=None):
+    models = cascade_models(payload, call_site)
+    for i, model in enumerate(models):
+        content = chat_completion(dict(payload, model=model), call_site=call_site, deadline=deadline)
+        try:
+            valid = bool(validate(content))
+        except Exception:
+            valid = False
+        if valid or i == len(models) - 1:
+            metrics.inc("copilot_model_routing_total", call_site=call_site, model=model, decision="accepted" if valid else "exhausted")
+            return content
+        metrics.inc("copilot_model_routing_total", call_site=call_site, model=model, decision="escalated")
+        # Escalation is no longer stale work; only the first attempt may be dropped while queued
+        deadline = None
+
+def analysis_payload(base64_image):
+    message_list = [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/jpeg;base64,{base64_image}"
+            }
+        },
+        {
+            "type": "text",
+            "text": ANALYSIS_PROMPT
+        }
+    ]
+
+    return route_payload("analysis", {
+        "messages": [
+            {
+                "role": "user",
+                "content": message_list
+            }
+        ]
+    })
+
+def analyze_image_openai(base64_image):
+    return chat_completion(analysis_payload(base64_image), call_site="analysis")
+
+def analyze_image_openai_stream(base64_image):
+    return stream_chat_completion(analysis_payload(base64_image), call_site="analysis")
+
+SUGGESTION_MODEL = MODEL_ROUTES["suggestions"]["model"]
+# Suggestions still waiting for an upstream slot after this many seconds are dropped; by then
+# the user has usually moved on and the questions would arrive too late to be useful
+SUGGESTION_MAX_WAIT = float(os.environ.get("COPILOT_SUGGESTION_MAX_WAIT", 10))
+SUGGESTION_PROMPT = "Strictly give the response only in JSON format containing a list of 4 questions based on the image. Sample response: '{'questions':['What is the image?']}'.Strictly enforce the json format without any descriptions"
+
+# How follow-ups get their suggested questions:
+#   "concurrent" - SUGGESTION_MODEL generates them in the background while the answer streams
+#   "structured" - the answer and the questions come back together in one JSON-schema response
+FOLLOW_UP_MODE = os.environ.get("COPILOT_FOLLOW_UP_MODE", "concurrent")
+
+FOLLOW_UP_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "follow_up",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer": {"type": "string"},
+                "questions": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["answer", "questions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Enough workers to fill the suggestions class's share of upstream slots; a smaller pool would
+# queue suggestions here while the scheduler still had room for them
+SUGGESTION_WORKERS = int(os.environ.get("COPILOT_SUGGESTION_WORKERS", http_client.scheduler.limits["suggestions"]))
+suggestion_executor = ThreadPoolExecutor(max_workers=SUGGESTION_WORKERS, thread_name_prefix="suggestions")
+
+def suggestion_payload(messages):
+    # Only role and content go upstream; history entries also carry display thumbnails
+    messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+    messages.append({
+            "role": "user",
+            "content": SUGGESTION_PROMPT
+        })
+
+    return route_payload("suggestions", {
+        "messages": messages,
+        "response_format": {"type": "json_object"}
+    })
+
+# Request for a follow-up question: the (budgeted) conversation plus the question and the graph.
+# With chart data (see chart_data_cached) its statistics go in as text and the graph is sent at
+# GROUNDED_IMAGE_DETAIL ("low" costs far fewer image tokens).
+def follow_up_payload(context_messages, user_query, base64_image, chart_data=None):
+    relevance_check_prompt = f"""Answer the given user query based on previous response and graph uploaded
+    User query:"{user_query}"
+    In the output highlight specific data points that helps making insights useful .
+    """
+    grounding = grounding_text(chart_data)
+    image_url = {"url": f"data:image/jpeg;base64,{base64_image}"}
+    if grounding:
+        relevance_check_prompt += "\n" + grounding
+        image_url["detail"] = GROUNDED_IMAGE_DETAIL
+
+    return route_payload("follow_up", {
+        "messages": context_messages + [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": relevance_check_prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": image_url
+                    }
+                ]
+            }
+        ]
+    })
+
+def clean_suggestions(questions):
+    if not isinstance(questions, list):
+        return []
+    return [question for question in questions if isinstance(question, str) and question.strip()][:4]
+
+# Yield the suggested questions one at a time, each as soon as its JSON string has streamed in.
+# The cascade escalates only when a model answered without a usable question; a request that
+# failed or was dropped as stale (DeadlineExceeded) ends the suggestions there. Never raises.
+def stream_suggestions(messages):
+    payload = suggestion_payload(messages)
+    deadline = time.monotonic() + SUGGESTION_MAX_WAIT
+    models = cascade_models(payload, "suggestions")
+    for i, model in enumerate(models):
+        parser = SuggestionParser()
+        parse_seconds = 0.0
+        try:
+            for delta in stream_chat_completion(dict(payload, model=model), call_site="suggestions", deadline=deadline):
+                start = time.perf_counter()
+                questions = parser.feed(delta)
+                parse_seconds += time.perf_counter() - start
+                yield from questions
+        except Exception:
+            # Suggestions are a convenience; never let them take the answer down with them
+            return
+        finally:
+            # Parsing is spread over the stream; recorded as one stage per response
+            metrics.observe("copilot_stage_duration_seconds", parse_seconds, stage="suggestion_parse")
+        if parser.questions or i == len(models) - 1:
+            metrics.inc("copilot_model_routing_total", call_site="suggestions", model=model,
+                        decision="accepted" if parser.questions else "exhausted")
+            return
+        metrics.inc("copilot_model_routing_total", call_site="suggestions", model=model, decision="escalated")
+        deadline = None
+
+def generate_suggestions(messages):
+    return list(stream_suggestions(messages))
+
+STRUCTURED_FOLLOW_UP_PROMPT = "Put your answer in 'answer' and 4 short follow-up questions about the graph the user could ask next in 'questions'."
+
+# Answer a follow-up and suggest the next questions with a single structured completion
+def answer_with_suggestions(payload):
+    payload = dict(payload, response_format=FOLLOW_UP_RESPONSE_FORMAT)
+    payload["messages"] = payload["messages"] + [{"role": "system", "content": STRUCTURED_FOLLOW_UP_PROMPT}]
+    content = cascade_completion(payload, "follow_up", parse_structured_follow_up)
+    return parse_structured_follow_up(content) or (content, [])
+
+def parse_structured_follow_up(content):
+    try:
+        response = json.loads(content)
+        return response["answer"], clean_suggestions(response["questions"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+# Follow-up answers are reused when the same question (after normalization, or TF-IDF similar
+# with COPILOT_ANSWER_SIMILARITY set) is asked about the same image after the same conversation.
+# COPILOT_ANSWER_CACHE=0 turns this off; callers can also bypass it per question.
+ANSWER_CACHE_ENABLED = os.environ.get("COPILOT_ANSWER_CACHE", "1") != "0"
+_answer_cache = None
+
+def get_answer_cache():
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache.from_env()
+    return _answer_cache
+
+# Scope of a follow-up answer: the image plus everything sent before the question
+def follow_up_scope(image_key, context_messages):
+    prior = [{"role": msg["role"], "content": msg["content"]} for msg in context_messages]
+    return AnalysisCache.make_key(image_key.encode("utf-8"), json.dumps(prior, sort_keys=True), FOLLOW_UP_MODE)
+
+def lookup_answer(scope, question, bypass=False):
+    """Cached {"answer", "suggestions"} for the question, or None."""
+    if bypass or not ANSWER_CACHE_ENABLED:
+        return None
+    cached = get_answer_cache().get(scope, question)
+    metrics.record_cache("answer", cached is not None)
+    return cached
+
+def store_answer(scope, question, answer, suggestions):
+    if ANSWER_CACHE_ENABLED and answer:
+        get_answer_cache().set(scope, question, {"answer": answer, "suggestions": suggestions})
+
+# Follow-up history is kept under this many tokens; older turns are summarized by a cheaper model
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("COPILOT_CONTEXT_TOKEN_BUDGET", 4000))
+CONTEXT_KEEP_RECENT = int(os.environ.get("COPILOT_CONTEXT_KEEP_RECENT", 4))
+SUMMARY_MODEL = MODEL_ROUTES["summary"]["model"]
+
+def summarize_conversation(summary, messages):
+    transcript = "\n\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    payload = route_payload("summary", {
+        "messages": [
+            {
+                "role": "user",
+                "content": f"""Update the running summary of a conversation about a manufacturing graph with the new turns below.
+            Keep every number, data point and conclusion that later questions may refer to. Answer with the summary only.
+
+            Running summary:
+            {summary or "(empty)"}
+
+            New turns:
+            {transcript}
+            """
+            }
+        ]
+    })
+    return chat_completion(payload, call_site="summary")
+
+def new_conversation_context():
+    return ConversationContext(summarize_conversation, token_budget=CONTEXT_TOKEN_BUDGET, keep_recent=CONTEXT_KEEP_RECENT, model=ANALYSIS_MODEL)
+
+# Preprocessing limits per model. High-detail vision inputs are fitted into 2048x2048 and then
+# scaled so the short side is 768px, so larger images only cost upload time and tokens.
+IMAGE_LIMITS = {
+    "gpt-4o": {"max_side": 2048, "max_short_side": 768},
+}
+DEFAULT_IMAGE_LIMITS = {"max_side": 2048, "max_short_side": 768}
+IMAGE_MAX_SIDE = int(os.environ.get("COPILOT_IMAGE_MAX_SIDE", 0))
+IMAGE_MAX_SHORT_SIDE = int(os.environ.get("COPILOT_IMAGE_MAX_SHORT_SIDE", 0))
+IMAGE_JPEG_QUALITY = int(os.environ.get("COPILOT_IMAGE_JPEG_QUALITY", 85))
+IMAGE_MIN_JPEG_QUALITY = int(os.environ.get("COPILOT_IMAGE_MIN_JPEG_QUALITY", 50))
+IMAGE_MAX_BYTES = int(os.environ.get("COPILOT_IMAGE_MAX_BYTES", 1024 * 1024))
+# Refuse to decompress anything bigger than this (a 20000x20000 TIFF is 1.2 GB of RGB)
+IMAGE_MAX_PIXELS = int(os.environ.get("COPILOT_IMAGE_MAX_PIXELS", 80_000_000))
+
+def image_target_size(width, height, model=ANALYSIS_MODEL):
+    limits = IMAGE_LIMITS.get(model, DEFAULT_IMAGE_LIMITS)
+    max_side = IMAGE_MAX_SIDE or limits["max_side"]
+    max_short_side = IMAGE_MAX_SHORT_SIDE or limits["max_short_side"]
+    scale = min(1.0, max_side / max(width, height), max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+# 16-bit, 32-bit and float grayscale (instrument and scientific TIFFs) to 8-bit. convert("L")
+# would clip every value above 255 to white, so the values are scaled instead: 16-bit by its
+# full range, the others by the range they actually use.
+def high_bit_depth_to_l(image):
+    if image.mode.startswith("I;16"):
+        low, high = 0, 65535
+    else:
+        low, high = image.getextrema()
+    scale = 255 / (high - low) if high > low else 0
+    if image.mode != "F":
+        image = image.convert("I")
+    return image.point(lambda v: (v - low) * scale).convert("L")
+
+# Function to convert any image format to JPEG, downscaled to what the model will look at
+# and re-encoded at the highest quality that fits the size budget. With fingerprint=True it
+# returns (jpeg, perceptual hash of the normalized image) instead. frame selects the page of
+# a multi-frame file; only that frame is decoded.
+def convert_to_jpeg(image_file, model=ANALYSIS_MODEL, fingerprint=False, frame=0):
+    from PIL import Image
+
+    image = Image.open(image_file)
+    if frame:
+        image.seek(frame)
+    return frame_to_jpeg(image, model, fingerprint)
+
+# JPEG of the current frame of an opened image; the source image is left as it is, so the
+# caller can seek on to the next frame
+def frame_to_jpeg(image, model=ANALYSIS_MODEL, fingerprint=False):
+    from PIL import Image
+
+    with metrics.stage("decode"):
+        if image.width * image.height > IMAGE_MAX_PIXELS:
+            raise ValueError(f"Image is {image.width}x{image.height}, larger than the {IMAGE_MAX_PIXELS} pixel limit")
+
+        size = image_target_size(image.width, image.height, model)
+        # For JPEG sources let the decoder downscale by a power of two while decoding
+        image.draft("RGB", size)
+        # Pillow decodes lazily; without this the decode would be timed as part of the next stage
+        image.load()
+
+        if image.mode in ("RGBA", "LA", "P", "PA"):
+            # Flatten transparency onto white; most chart exports have a transparent background
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode.startswith("I") or image.mode == "F":
+            image = high_bit_depth_to_l(image)
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+    if image.size != size:
+        with metrics.stage("resize"):
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+    if fingerprint:
+        with metrics.stage("fingerprint"):
+            image_fingerprint = dhash(image)
+
+    with metrics.stage("jpeg_encode"):
+        quality = IMAGE_JPEG_QUALITY
+        while True:
+            jpeg_image = io.BytesIO()
+            image.save(jpeg_image, format="JPEG", quality=quality, optimize=True)
+            if jpeg_image.tell() <= IMAGE_MAX_BYTES or quality <= IMAGE_MIN_JPEG_QUALITY:
+                break
+            quality = max(IMAGE_MIN_JPEG_QUALITY, quality - 10)
+    jpeg_image.seek(0)
+    if fingerprint:
+        return jpeg_image, image_fingerprint
+    return jpeg_image
+
+# Encode the image to base64
+def encode_image(image_file):
+    jpeg_image = convert_to_jpeg(image_file)
+    with metrics.stage("base64_encode"):
+        return base64.b64encode(jpeg_image.read()).decode('utf-8')
+
+def encode_image_bytes(image_bytes):
+    return encode_image(io.BytesIO(image_bytes))
+
+# The API server normalizes uploads in a process pool (see image_pool); created on first use
+_image_pool = None
+
+def get_image_pool():
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ImagePool.from_env()
+    return _image_pool
+
+async def encode_image_async(image_bytes, wait=False):
+    return await get_image_pool().run(encode_image_bytes, image_bytes, wait=wait)
+
+def decode_image(base64_image):
+    from PIL import Image
+
+    image_data = base64.b64decode(base64_image)
+    return Image.open(io.BytesIO(image_data))
+
+# Normalize an upload once per conversation: the JPEG and base64 payload sent to the model,
+# a small thumbnail for the chat history, the analysis cache key of the original bytes, the
+# perceptual fingerprint used to find analyses of near-duplicate charts and the chart data
+THUMBNAIL_SIZE = (800, 800)
+
+def prepare_image(image_file):
+    from PIL import Image
+
+    image_bytes = image_file.getvalue()
+    jpeg_image, fingerprint = convert_to_jpeg(io.BytesIO(image_bytes), fingerprint=True)
+    jpeg_bytes = jpeg_image.getvalue()
+
+    with metrics.stage("thumbnail"):
+        thumbnail = Image.open(io.BytesIO(jpeg_bytes))
+        thumbnail.draft("RGB", THUMBNAIL_SIZE)
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+        thumbnail_bytes = io.BytesIO()
+        thumbnail.save(thumbnail_bytes, format="JPEG")
+
+    with metrics.stage("base64_encode"):
+        base64_image = base64.b64encode(jpeg_bytes).decode('utf-8')
+
+    key = analysis_key(image_bytes)
+    return {
+        "key": key,
+        "jpeg": jpeg_bytes,
+        "base64": base64_image,
+        "thumbnail": thumbnail_bytes.getvalue(),
+        "fingerprint": fingerprint,
+        "chart_data": chart_data_cached(key, jpeg_bytes)
+    }
+
+def analysis_key(image_bytes):
+    return AnalysisCache.make_key(image_bytes, ANALYSIS_MODEL, ANALYSIS_PROMPT)
+
+def lookup_analysis(key):
+    openai_analysis = get_analysis_cache().get(key)
+    metrics.record_cache("analysis", openai_analysis is not None)
+    return openai_analysis
+
+# Near-duplicate charts: analyses are indexed by perceptual fingerprint, and an upload whose
+# bytes were never analyzed can be offered the analysis of a chart within this many differing
+# bits (out of 64). 0 turns the lookup off.
+SIMILAR_MAX_DISTANCE = int(os.environ.get("COPILOT_SIMILAR_MAX_DISTANCE", 6))
+_fingerprint_index = None
+
+def get_fingerprint_index():
+    global _fingerprint_index
+    if _fingerprint_index is None:
+        _fingerprint_index = FingerprintIndex.from_env()
+    return _fingerprint_index
+
+def index_fingerprint(key, fingerprint):
+    if SIMILAR_MAX_DISTANCE > 0:
+        get_fingerprint_index().add(fingerprint, key)
+
+def find_similar_analysis(key, fingerprint):
+    """{"key", "distance", "analysis"} of the closest near-duplicate, or None if the image itself is cached or nothing is close."""
+    if SIMILAR_MAX_DISTANCE <= 0 or get_analysis_cache().get(key) is not None:
+        return None
+    for distance, similar_key in get_fingerprint_index().search(fingerprint, SIMILAR_MAX_DISTANCE):
+        openai_analysis = get_analysis_cache().get(similar_key) if similar_key != key else None
+        if openai_analysis is not None:
+            metrics.record_cache("similar_analysis", True)
+            return {"key": similar_key, "distance": distance, "analysis": openai_analysis}
+    metrics.record_cache("similar_analysis", False)
+    return None
+
+# The user accepted a near-duplicate's analysis: keep it under this image's own key as well
+def accept_similar_analysis(key, fingerprint, openai_analysis):
+    get_analysis_cache().set(key, openai_analysis)
+    index_fingerprint(key, fingerprint)
+
+# Local chart reading (see chart_data): series and their statistics, extracted from the
+# normalized JPEG and cached per image. Follow-ups get them as grounding text. With
+# COPILOT_LOCAL_ANSWERS=1, simple lookups ("what's the max?") are answered from them without a
+# model call; that is off by default because without reading the axis labels the answers are
+# positions on the plot, not values. COPILOT_CHART_DATA=0 turns extraction off.
+CHART_DATA_ENABLED = os.environ.get("COPILOT_CHART_DATA", "1") != "0"
+LOCAL_ANSWERS_ENABLED = os.environ.get("COPILOT_LOCAL_ANSWERS", "0") == "1"
+# Detail level of the follow-up image when grounding text is sent with it ("low", "high" or "auto").
+# The grounding has no axis values, so "low" saves image tokens at the cost of answers that
+# need to read the axes; opt in once that trade-off has been checked for your charts.
+GROUNDED_IMAGE_DETAIL = os.environ.get("COPILOT_GROUNDED_IMAGE_DETAIL", "auto")
+
+def chart_data_cached(key, jpeg_bytes):
+    """Chart data of the image with analysis key key, or None when extraction is off or failed."""
+    if not CHART_DATA_ENABLED:
+        return None
+    cache_key = AnalysisCache.make_key(key.encode("utf-8"), "chart_data", CHART_DATA_VERSION)
+    chart_data = get_analysis_cache().get(cache_key)
+    metrics.record_cache("chart_data", chart_data is not None)
+    if chart_data is None:
+        try:
+            with metrics.stage("chart_data"):
+                chart_data = extract_chart_data(jpeg_bytes)
+        except Exception as e:
+            # The model can still read the chart itself; never fail an upload over this
+            metrics.log_request("chart_data_failed", error=str(e) or type(e).__name__)
+            return None
+        get_analysis_cache().set(cache_key, chart_data)
+    return chart_data
+
+def answer_from_chart_data(chart_data, question):
+    """Local answer to the question, or None if it needs the model."""
+    if not LOCAL_ANSWERS_ENABLED:
+        return None
+    answer = answer_locally(chart_data, question)
+    metrics.inc("copilot_local_answers_total", outcome="answered" if answer else "model")
+    return answer
+
+# Analyze an encoded image, reusing a previous analysis of the same image when there is one
+def analyze_image_cached(key, base64_image):
+    openai_analysis = lookup_analysis(key)
+    if openai_analysis is None:
+        openai_analysis = analyze_image_openai(base64_image)
+        get_analysis_cache().set(key, openai_analysis)
+    return openai_analysis
+
+# Analysis of raw image bytes for headless callers; the image is only normalized on a cache miss
+def analyze_image_bytes(image_bytes, priority="analysis"):
+    key = analysis_key(image_bytes)
+    openai_analysis = lookup_analysis(key)
+    if openai_analysis is None:
+        openai_analysis = chat_completion(analysis_payload(encode_image_bytes(image_bytes)), call_site="analysis", priority=priority)
+        get_analysis_cache().set(key, openai_analysis)
+    return openai_analysis
+
+# Streaming counterpart of analyze_image_cached; only a fully received analysis is cached
+def analyze_image_cached_stream(key, base64_image):
+    openai_analysis = lookup_analysis(key)
+    if openai_analysis is not None:
+        yield openai_analysis
+        return
+
+    chunks = []
+    for delta in analyze_image_openai_stream(base64_image):
+        chunks.append(delta)
+        yield delta
+    get_analysis_cache().set(key, "".join(chunks))
+
+# Precomputed example answers are only valid for the prompts and models that produced them
+def example_version(image_bytes):
+    return AnalysisCache.make_key(image_bytes, ANALYSIS_MODEL, ANALYSIS_PROMPT, SUGGESTION_MODEL, SUGGESTION_PROMPT)
+
+def precompute_example(image_bytes):
+    image = prepare_image(io.BytesIO(image_bytes))
+    openai_analysis = analyze_image_cached(image["key"], image["base64"])
+    index_fingerprint(image["key"], image["fingerprint"])
+    history = [
+        {"role": "user", "content": "Uploaded an image for analysis."},
+        {"role": "assistant", "content": openai_analysis}
+    ]
+    return {"analysis": openai_analysis, "suggestions": generate_suggestions(history)}
+
+# Multi-page uploads (multi-frame TIFF quality reports, a chart per page). Pages are decoded one
+# frame at a time by the task that analyzes them, at most PAGE_PARALLELISM at once, and
+# results come back per page as each finishes. Each page is cached under the key of its
+# normalized JPEG, so re-exported reports only pay for the pages that changed.
+PAGE_PARALLELISM = int(os.environ.get("COPILOT_PAGE_PARALLELISM", 4))
+MAX_PAGES = int(os.environ.get("COPILOT_MAX_PAGES", 50))
+REPORT_SUMMARY_MODEL = MODEL_ROUTES["report_summary"]["model"]
+REPORT_SUMMARY_PROMPT = "These are analyses of the charts on the pages of one report. Summarize the report as a whole in 1-2 short paragraphs: the overall picture, trends that recur across pages and the pages that need attention. Highlight important numbers using bold."
+
+def page_count(image_bytes):
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return getattr(image, "n_frames", 1)
+
+def encode_page(image_bytes, page):
+    """(analysis key, base64 JPEG) of one page, counted from 0."""
+    jpeg_bytes = convert_to_jpeg(io.BytesIO(image_bytes), frame=page).getvalue()
+    with metrics.stage("base64_encode"):
+        return analysis_key(jpeg_bytes), base64.b64encode(jpeg_bytes).decode('utf-8')
+
+def encode_pages(image_bytes, pages):
+    """[(page, analysis key, base64 JPEG)] for a run of pages, walking the frames of a single open of the upload."""
+    from PIL import Image
+
+    encoded = []
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        for page in pages:
+            image.seek(page)
+            jpeg_bytes = frame_to_jpeg(image).getvalue()
+            with metrics.stage("base64_encode"):
+                encoded.append((page, analysis_key(jpeg_bytes), base64.b64encode(jpeg_bytes).decode('utf-8')))
+    return encoded
+
+def analyze_page(image_bytes, page):
+    return analyze_image_cached(*encode_page(image_bytes, page))
+
+def analyze_pages(image_bytes, pages):
+    """Yield {"page", "pages", "openai_analysis" or "error"} per page (numbered from 1) in completion order."""
+    executor = ThreadPoolExecutor(PAGE_PARALLELISM, thread_name_prefix="pages")
+    try:
+        futures = {executor.submit(analyze_page, image_bytes, page): page for page in range(min(pages, MAX_PAGES))}
+        for future in as_completed(futures):
+            result = {"page": futures[future] + 1, "pages": pages}
+            try:
+                result["openai_analysis"] = future.result()
+            except Exception as e:
+                result["error"] = str(e) or type(e).__name__
+            yield result
+    finally:
+        # Pages not started yet are dropped when the caller stops listening
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def report_summary_payload(analyses):
+    """analyses: (page, analysis) pairs in page order."""
+    pages = "\n\n".join(f"Page {page}:\n{analysis}" for page, analysis in analyses)
+    return route_payload("report_summary", {
+        "messages": [{"role": "user", "content": f"{REPORT_SUMMARY_PROMPT}\n\n{pages}"}]
+    })
+
+def report_summary_key(analyses):
+    return AnalysisCache.make_key(json.dumps(analyses).encode("utf-8"), REPORT_SUMMARY_MODEL, REPORT_SUMMARY_PROMPT)
+
+def summarize_pages(analyses):
+    key = report_summary_key(analyses)
+    summary = get_analysis_cache().get(key)
+    metrics.record_cache("report_summary", summary is not None)
+    if summary is None:
+        summary = chat_completion(report_summary_payload(analyses), call_site="report_summary")
+        get_analysis_cache().set(key, summary)
+    return summary
+
+# Event-loop friendly versions of the above for the API server: blocking cache and Pillow
+# work runs in worker threads, model calls go through the pooled async client
+async def analyze_image_cached_async(image_bytes, priority="analysis"):
+    key = await asyncio.to_thread(analysis_key, image_bytes)
+    openai_analysis = await asyncio.to_thread(lookup_analysis, key)
+    if openai_analysis is None:
+        # Batch work waits for room in the image pool instead of being turned away
+        base64_image = await encode_image_async(image_bytes, wait=priority == "batch")
+        openai_analysis = await chat_completion_async(analysis_payload(base64_image), call_site="analysis", priority=priority)
+        await asyncio.to_thread(get_analysis_cache().set, key, openai_analysis)
+    return openai_analysis
+
+async def analyze_image_cached_stream_async(image_bytes):
+    key = await asyncio.to_thread(analysis_key, image_bytes)
+    openai_analysis = await asyncio.to_thread(lookup_analysis, key)
+    if openai_analysis is not None:
+        yield openai_analysis
+        return
+
+    base64_image = await encode_image_async(image_bytes)
+    chunks = []
+    async for delta in stream_chat_completion_async(analysis_payload(base64_image), call_site="analysis"):
+        chunks.append(delta)
+        yield delta
+    await asyncio.to_thread(get_analysis_cache().set, key, "".join(chunks))
+
+async def analyze_encoded_page_async(key, base64_image, priority="analysis"):
+    openai_analysis = await asyncio.to_thread(lookup_analysis, key)
+    if openai_analysis is None:
+        openai_analysis = await chat_completion_async(analysis_payload(base64_image), call_site="analysis", priority=priority)
+        await asyncio.to_thread(get_analysis_cache().set, key, openai_analysis)
+    return openai_analysis
+
+# The pages are split into PAGE_PARALLELISM runs of consecutive pages and each run is encoded
+# by one pool task, so the upload is sent to the pool once per run rather than once per page
+# and every worker walks its frames in order. A page goes to the model as soon as its run is
+# encoded.
+async def analyze_pages_async(image_bytes, pages, priority="analysis"):
+    count = min(pages, MAX_PAGES)
+    run_length = -(-count // PAGE_PARALLELISM)
+    slots = asyncio.Semaphore(PAGE_PARALLELISM)
+    results = asyncio.Queue()
+
+    async def analyze_one(page, key, base64_image):
+        result = {"page": page + 1, "pages": pages}
+        async with slots:
+            try:
+                result["openai_analysis"] = await analyze_encoded_page_async(key, base64_image, priority)
+            except Exception as e:
+                result["error"] = str(e) or type(e).__name__
+        results.put_nowait(result)
+
+    async def analyze_run(run):
+        try:
+            encoded = await get_image_pool().run(partial(encode_pages, pages=run), image_bytes, wait=priority == "batch")
+        except Exception as e:
+            for page in run:
+                results.put_nowait({"page": page + 1, "pages": pages, "error": str(e) or type(e).__name__})
+            return
+        await asyncio.gather(*(analyze_one(*page) for page in encoded))
+
+    tasks = [asyncio.create_task(analyze_run(range(first, min(first + run_length, count))))
+             for first in range(0, count, run_length)]
+    try:
+        for _ in range(count):
+            yield await results.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def summarize_pages_async(analyses):
+    key = report_summary_key(analyses)
+    summary = await asyncio.to_thread(get_analysis_cache().get, key)
+    metrics.record_cache("report_summary", summary is not None)
+    if summary is None:
+        summary = await chat_completion_async(report_summary_payload(analyses), call_site="report_summary")
+        await asyncio.to_thread(get_analysis_cache().set, key, summary)
+    return summary
@@ -0,0 +1,391 @@
+import asyncio
+import collections
+import email.utils
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+
+# Process-wide client layer for everything that talks to the model API: pooled keep-alive
+# connections, timeouts, retries with jittered exponential backoff that honour Retry-After,
+# and a client-side token bucket sized to the organisation's RPM/TPM quota. requests and httpx
+# are imported on first use, so the UI never loads httpx and the API never loads requests.
+OPENAI_TIMEOUT = float(os.environ.get("COPILOT_OPENAI_TIMEOUT", 120))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("COPILOT_OPENAI_CONNECT_TIMEOUT", 10))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("COPILOT_MAX_CONCURRENT_REQUESTS", 32))
+MAX_RETRIES = int(os.environ.get("COPILOT_OPENAI_MAX_RETRIES", 4))
+BACKOFF_BASE = float(os.environ.get("COPILOT_OPENAI_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.environ.get("COPILOT_OPENAI_BACKOFF_MAX", 30))
+# 0 disables the corresponding limit
+RATE_LIMIT_RPM = int(os.environ.get("COPILOT_OPENAI_RPM", 0))
+RATE_LIMIT_TPM = int(os.environ.get("COPILOT_OPENAI_TPM", 0))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# A high-detail image at the preprocessed size (1365x768) is 6 tiles of 170 tokens plus 85
+IMAGE_TOKEN_ESTIMATE = 1105
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"Model API returned {status_code}: {message}")
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Requests-per-minute and tokens-per-minute limiter shared by every caller in the process."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_reserve(self, tokens):
+        """Take capacity for one request if it is there now and return 0.0, else return how long until it will be."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            if self.requests_per_minute:
+                self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+            if self.tokens_per_minute:
+                self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+                tokens = min(tokens, self.tokens_per_minute)
+
+            wait = 0.0
+            if self.requests_per_minute and self._requests < 1:
+                wait = (1 - self._requests) / (self.requests_per_minute / 60)
+            if self.tokens_per_minute and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) / (self.tokens_per_minute / 60))
+            if wait == 0.0 and self.requests_per_minute:
+                self._requests -= 1
+            if wait == 0.0 and self.tokens_per_minute:
+                self._tokens -= tokens
+            return wait
+
+
+rate_limiter = TokenBucket(RATE_LIMIT_RPM, RATE_LIMIT_TPM)
+
+
+# Priority classes for upstream requests, most urgent first, and the share of
+# MAX_CONCURRENT_REQUESTS each class may occupy at once. On top of the per-class shares, the
+# background classes together never hold more than capacity - RESERVED_INTERACTIVE slots, so
+# interactive requests find a free slot even when bulk work saturates the queue.
+PRIORITIES = ("interactive", "analysis", "suggestions", "batch")
+PRIORITY_SHARES = {"interactive": 1.0, "analysis": 0.75, "suggestions": 0.5, "batch": 0.5}
+for item in filter(None, os.environ.get("COPILOT_PRIORITY_SHARES", "").split(",")):
+    name, _, share = item.partition("=")
+    PRIORITY_SHARES[name.strip()] = float(share)
+RESERVED_INTERACTIVE = int(os.environ.get("COPILOT_RESERVED_INTERACTIVE", max(1, MAX_CONCURRENT_REQUESTS // 8)))
+
+
+class DeadlineExceeded(Exception):
+    """A request was still waiting for an upstream slot when its deadline passed and was dropped."""
+
+
+class _Waiter:
+    __slots__ = ("priority", "deadline", "tokens", "notify", "granted", "dropped")
+
+    def __init__(self, priority, deadline, tokens, notify):
+        self.priority = priority
+        self.deadline = deadline
+        self.tokens = tokens
+        self.notify = notify
+        self.granted = False
+        self.dropped = False
+
+
+class UpstreamScheduler:
+    """Hands out upstream slots by priority class, to threads and to coroutines alike.
+
+    A free slot goes to the oldest waiter of the most urgent class that is below its share;
+    waiters whose deadline (time.monotonic()) has passed are dropped instead of being served.
+    The RPM/TPM quota is taken in the same order when a slot is granted: while the bucket is
+    empty nobody is granted, and the next waiter in priority order gets the quota as it refills.
+    """
+
+    def __init__(self, capacity, shares, reserved_interactive=0, bucket=None):
+        self.capacity = capacity
+        self.limits = {priority: max(1, round(capacity * shares.get(priority, 1.0))) for priority in PRIORITIES}
+        self.background_limit = max(1, capacity - reserved_interactive)
+        self.bucket = bucket
+        self._queues = {priority: collections.deque() for priority in PRIORITIES}
+        self._in_flight = dict.fromkeys(PRIORITIES, 0)
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _enqueue(self, priority, deadline, tokens, notify):
+        waiter = _Waiter(priority, deadline, tokens, notify)
+        with self._lock:
+            self._queues[priority].append(waiter)
+            self._dispatch()
+        return waiter
+
+    def _next_priority(self):
+        """Most urgent class with a waiter that may take a slot now, or None."""
+        if sum(self._in_flight.values()) >= self.capacity:
+            return None
+        background = sum(self._in_flight.values()) - self._in_flight["interactive"]
+        for priority in PRIORITIES:
+            if not self._queues[priority] or self._in_flight[priority] >= self.limits[priority]:
+                continue
+            if priority != "interactive" and background >= self.background_limit:
+                continue
+            return priority
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for queue in self._queues.values():
+            while queue and queue[0].deadline is not None and queue[0].deadline <= now:
+                waiter = queue.popleft()
+                waiter.dropped = True
+                waiter.notify()
+
+        while (priority := self._next_priority()) is not None:
+            queue = self._queues[priority]
+            waiter = queue[0]
+            if waiter.deadline is not None and waiter.deadline <= now:
+                queue.popleft()
+                waiter.dropped = True
+                waiter.notify()
+                continue
+            wait = self.bucket.try_reserve(waiter.tokens) if self.bucket else 0.0
+            if wait > 0:
+                self._wake_after(wait)
+                return
+            queue.popleft()
+            waiter.granted = True
+            self._in_flight[priority] += 1
+            waiter.notify()
+
+    def _wake_after(self, delay):
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _abandon(self, waiter):
+        """Called when a waiter stops waiting; True if it had been granted a slot after all."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            if not waiter.dropped:
+                self._queues[waiter.priority].remove(waiter)
+            return False
+
+    def release(self, priority):
+        with self._lock:
+            self._in_flight[priority] -= 1
+            self._dispatch()
+
+    def _granted_or_drop(self, waiter, start):
+        metrics.observe("copilot_scheduler_wait_seconds", time.monotonic() - start, priority=waiter.priority)
+        if not waiter.granted:
+            metrics.inc("copilot_scheduler_dropped_total", priority=waiter.priority)
+            raise DeadlineExceeded(f"No upstream slot for {waiter.priority} request before its deadline")
+
+    @contextmanager
+    def slot(self, priority, deadline=None, tokens=0):
+        """Hold an upstream slot, with tokens (see estimate_tokens) of the rate-limit quota taken."""
+        start = time.monotonic()
+        event = threading.Event()
+        waiter = self._enqueue(priority, deadline, tokens, event.set)
+        if not event.wait(None if deadline is None else max(0.0, deadline - start)):
+            self._abandon(waiter)
+        self._granted_or_drop(waiter, start)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    @asynccontextmanager
+    async def slot_async(self, priority, deadline=None, tokens=0):
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(priority, deadline, tokens, notify)
+        try:
+            await asyncio.wait_for(future, None if deadline is None else max(0.0, deadline - start))
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release(priority)
+            raise
+        self._granted_or_drop(waiter, start)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+
+def estimate_tokens(payload):
+    """Rough prompt plus completion size of a chat payload, for the TPM bucket."""
+    tokens = payload.get("max_tokens", 1024)
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4 + 4
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKEN_ESTIMATE
+            else:
+                tokens += len(part.get("text", "")) // 4
+    return tokens
+
+
+def retry_delay(attempt, headers=None):
+    """Seconds to wait before retry number attempt + 1: the server's hint if it gave one, else full jitter."""
+    headers = headers or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return min(float(retry_after_ms) / 1000, BACKOFF_MAX)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after).timestamp()
+                return min(max(0.0, retry_at - time.time()), BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def error_message(response):
+    try:
+        return response.json()["error"]["message"]
+    except Exception:
+        return response.text[:200]
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault("timeout", (OPENAI_CONNECT_TIMEOUT, OPENAI_TIMEOUT))
+    return get_session().get(url, **kwargs)
+
+
+def post_json(url, payload, headers, stream=False):
+    """POST a model request, retrying throttled and failed attempts; raises UpstreamError on a final error status.
+
+    The rate-limit quota is taken with the scheduler slot (scheduler.slot(..., tokens=...)).
+    """
+    import requests
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = get_session().post(url, headers=headers, json=payload, stream=stream, timeout=(OPENAI_CONNECT_TIMEOUT, OPENAI_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            metrics.inc("copilot_upstream_retries_total", status="connection_error")
+            time.sleep(retry_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            metrics.inc("copilot_upstream_retries_total", status=response.status_code)
+            delay = retry_delay(attempt, response.headers)
+            response.close()
+            time.sleep(delay)
+            continue
+        if response.status_code >= 400:
+            message = error_message(response)
+            response.close()
+            raise UpstreamError(response.status_code, message)
+        return response
+
+
+# At most MAX_CONCURRENT_REQUESTS model requests are in flight per process, sync and async
+# together; a burst queues here by priority instead of at OpenAI, and so does rate limiting
+scheduler = UpstreamScheduler(MAX_CONCURRENT_REQUESTS, PRIORITY_SHARES, RESERVED_INTERACTIVE, rate_limiter)
+
+# Async side, used by the API server: one pooled client per process
+_async_client = None
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def post_json_async(url, payload, headers, stream=False):
+    """Async post_json. With stream=True the caller must close the returned response."""
+    import httpx
+
+    client = get_async_client()
+    for attempt in range(MAX_RETRIES + 1):
+        request = client.build_request("POST", url, headers=headers, json=payload)
+        try:
+            response = await client.send(request, stream=stream)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError):
+            if attempt == MAX_RETRIES:
+                raise
+            metrics.inc("copilot_upstream_retries_total", status="connection_error")
+            await asyncio.sleep(retry_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            metrics.inc("copilot_upstream_retries_total", status=response.status_code)
+            delay = retry_delay(attempt, response.headers)
+            await response.aclose()
+            await asyncio.sleep(delay)
+            continue
+        if response.status_code >= 400:
+            if stream:
+                await response.aread()
+            message = error_message(response)
+            await response.aclose()
+            raise UpstreamError(response.status_code, message)
+        return response
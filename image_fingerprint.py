@@ -0,0 +1,174 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+# Perceptual fingerprints for spotting near-duplicate charts: the same dashboard re-exported
+# with another timestamp, a slightly different crop or a different compression level gets a
+# different byte hash but (almost) the same difference hash.
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash of a PIL image: is each pixel of a tiny grayscale copy brighter than its right neighbour."""
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+# Burkhard-Keller tree over Hamming distance: a query only visits the children whose edge
+# distance lies within max_distance of its distance to the node (triangle inequality)
+class BKTree:
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, fingerprint, value):
+        self._size += 1
+        if self._root is None:
+            self._root = (fingerprint, [value], {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(fingerprint, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (fingerprint, [value], {})
+                return
+            node = child
+
+    def search(self, fingerprint, max_distance):
+        """(distance, value) pairs within max_distance, nearest first."""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(fingerprint, node[0])
+            if distance <= max_distance:
+                found.extend((distance, value) for value in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+# Fingerprint -> analysis cache key, kept in memory as a BK-tree and appended to a JSON-lines
+# file so it survives restarts. Keys whose analysis has since expired are skipped by callers.
+# Only the newest max_entries keys are searchable. The tree and the file also hold the
+# entries evicted since the last compaction; once there are max_entries // 4 of those, both
+# are rebuilt from the live entries.
+class FingerprintIndex:
+    def __init__(self, path, max_entries=100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._tree = BKTree()
+        # key -> fingerprint, oldest first
+        self._entries = OrderedDict()
+        # Lines in the file, live or not
+        self._lines = 0
+        self._torn = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("COPILOT_FINGERPRINT_INDEX", os.path.join(".cache", "fingerprints.jsonl")),
+            max_entries=int(os.environ.get("COPILOT_FINGERPRINT_ENTRIES", 100_000)),
+        )
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    # A crash mid-append leaves a line without its newline
+                    self._torn = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        fingerprint, key = entry["fingerprint"], entry["key"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    self._entries.setdefault(key, fingerprint)
+        except OSError:
+            self._entries.clear()
+            return
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if self._lines - len(self._entries) > self._slack():
+            self._compact()
+        else:
+            for key, fingerprint in self._entries.items():
+                self._tree.add(fingerprint, key)
+
+    def _slack(self):
+        return max(1, self.max_entries // 4)
+
+    def _compact(self):
+        self._tree = BKTree()
+        for key, fingerprint in self._entries.items():
+            self._tree.add(fingerprint, key)
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for key, fingerprint in self._entries.items():
+                    f.write(json.dumps({"fingerprint": fingerprint, "key": key}) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._lines = len(self._entries)
+        self._torn = False
+
+    def add(self, fingerprint, key):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = fingerprint
+            self._tree.add(fingerprint, key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self._lines + 1 - len(self._entries) > self._slack():
+                self._compact()
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    # Finish a torn last line first so it does not swallow this entry
+                    f.write(("\n" if self._torn else "") + json.dumps({"fingerprint": fingerprint, "key": key}) + "\n")
+            except OSError:
+                return
+            self._lines += 1
+            self._torn = False
+
+    def search(self, fingerprint, max_distance):
+        with self._lock:
+            # Skip evicted entries still in the tree until the next compaction
+            return [(distance, key) for distance, key in self._tree.search(fingerprint, max_distance)
+                    if key in self._entries and hamming(fingerprint, self._entries[key]) == distance]
@@ -0,0 +1,111 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+
+class ImagePoolBusy(Exception):
+    """The image pool already has max_pending tasks; the caller should shed load (HTTP 503)."""
+
+
+def _noop():
+    return None
+
+
+def _run_collected(fn, image_bytes):
+    """fn(image_bytes) in a worker process, with the stage timings it recorded."""
+    with metrics.collect_observations() as observations:
+        result = fn(image_bytes)
+    return result, observations
+
+
+# Process pool for CPU-bound image work (decode, resize, JPEG and base64 encode), so large
+# uploads use every core and never run on the API's event loop. Uploads smaller than
+# inline_bytes skip the pool and run in a thread, which avoids the pickling round trip where it
+# would cost more than it saves. At most max_pending pool tasks are accepted at once, beyond
+# that run() raises ImagePoolBusy; a task that takes longer than timeout raises TimeoutError
+# (a queued task is cancelled, one already running finishes in the background and stays
+# counted until then).
+class ImagePool:
+    def __init__(self, workers, max_pending, timeout, inline_bytes):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.inline_bytes = inline_bytes
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        workers = int(os.environ.get("COPILOT_IMAGE_WORKERS", os.cpu_count() or 2))
+        return cls(
+            workers,
+            max_pending=int(os.environ.get("COPILOT_IMAGE_QUEUE_DEPTH", workers * 4)),
+            timeout=float(os.environ.get("COPILOT_IMAGE_TASK_TIMEOUT", 30)),
+            inline_bytes=int(os.environ.get("COPILOT_IMAGE_INLINE_BYTES", 256 * 1024)),
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn rather than fork: the API process has threads and an event loop running
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    async def start(self):
+        """Start the worker processes ahead of the first upload."""
+        if self.workers > 0:
+            executor = self._get_executor()
+            await asyncio.gather(*(asyncio.wrap_future(executor.submit(_noop)) for _ in range(self.workers)))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, image_bytes, wait=False):
+        """fn(image_bytes) in a worker process (or a thread for small images).
+
+        With wait=True a full queue is waited out instead of raising ImagePoolBusy; meant for
+        background work that has no client to push back on.
+        """
+        if self.workers <= 0 or len(image_bytes) < self.inline_bytes:
+            return await asyncio.to_thread(fn, image_bytes)
+
+        while True:
+            with self._lock:
+                if self._pending < self.max_pending:
+                    self._pending += 1
+                    break
+                pending = self._pending
+            if not wait:
+                metrics.inc("copilot_image_pool_rejected_total")
+                raise ImagePoolBusy(f"{pending} images are already being processed")
+            await asyncio.sleep(0.05)
+        try:
+            future = self._get_executor().submit(_run_collected, fn, image_bytes)
+        except BrokenProcessPool:
+            self._finished(None)
+            self.shutdown()
+            raise
+        future.add_done_callback(self._finished)
+
+        with metrics.stage("image_pool"):
+            try:
+                result, observations = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            except BrokenProcessPool:
+                # A worker died (out of memory on a huge image, say); start over with a fresh pool
+                self.shutdown()
+                raise
+        metrics.replay(observations)
+        return result
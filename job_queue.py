@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Durable job queue in a local SQLite file, shared by every API process that points at it.
+# A job is claimed by a worker for a lease; if the worker dies the lease runs out and another
+# worker picks the job up again, until it has been tried max_attempts times. Results stay in
+# the database for retention seconds after the job finished, the uploaded input only until then.
+class JobQueue:
+    def __init__(self, path, lease=600, max_attempts=3, retention=7 * 24 * 3600):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                input BLOB,
+                webhook TEXT,
+                result TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+        """)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("COPILOT_JOB_DB", os.path.join(".cache", "jobs.sqlite3")),
+            lease=float(os.environ.get("COPILOT_JOB_LEASE", 600)),
+            max_attempts=int(os.environ.get("COPILOT_JOB_MAX_ATTEMPTS", 3)),
+            retention=float(os.environ.get("COPILOT_JOB_RETENTION", 7 * 24 * 3600)),
+        )
+
+    def submit(self, data, webhook=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT INTO jobs (id, status, created, updated, input, webhook) VALUES (?, 'queued', ?, ?, ?, ?)",
+                             (job_id, now, now, data, webhook))
+        return job_id
+
+    def claim(self):
+        """Lease the oldest runnable job: {"id", "created", "input", "webhook", "attempts"}, or None."""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock before the SELECT, so two processes cannot
+            # claim the same job (UPDATE ... RETURNING would need SQLite 3.35)
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("""
+                    UPDATE jobs SET status = 'failed', error = 'Gave up after ' || attempts || ' attempts', input = NULL, updated = ?
+                    WHERE status = 'running' AND lease_until < ? AND attempts >= ?""", (now, now, self.max_attempts))
+                row = self._db.execute("""
+                    SELECT id, created, input, webhook, attempts FROM jobs
+                    WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                    ORDER BY created LIMIT 1""", (now,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated = ? WHERE id = ?",
+                                     (now + self.lease, now, row["id"]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return dict(row, attempts=row["attempts"] + 1)
+
+    def complete(self, job_id, result):
+        self._finish(job_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, input = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                             (status, result, error, time.time(), job_id))
+
+    def get(self, job_id):
+        """Public view of a job (no input), or None if it is unknown or expired."""
+        with self._lock:
+            row = self._db.execute("SELECT id, status, created, updated, attempts, result, error FROM jobs WHERE id = ?",
+                                   (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {"job_id": row["id"], "status": row["status"], "created": row["created"], "updated": row["updated"],
+               "attempts": row["attempts"]}
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def prune(self):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (time.time() - self.retention,))
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Minimal in-process metrics registry rendered in the Prometheus text format. Counters and
+# histograms are keyed by metric name plus a sorted tuple of label pairs.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+DESCRIPTIONS = {
+    "copilot_stage_duration_seconds": "Time spent in each local processing stage",
+    "copilot_upstream_duration_seconds": "Model API request time per call site, until the full response was received",
+    "copilot_time_to_first_token_seconds": "Time until the first streamed token per call site",
+    "copilot_upstream_requests_total": "Model API requests per call site, model and outcome",
+    "copilot_model_routing_total": "Cascade steps per call site and model: accepted, escalated or exhausted",
+    "copilot_upstream_retries_total": "Model API attempts that were retried, by status",
+    "copilot_tokens_total": "Tokens reported in completion usage, per call site and type",
+    "copilot_cache_requests_total": "Cache lookups by cache and result",
+    "copilot_http_request_duration_seconds": "API server request time by route and status",
+    "copilot_job_wait_seconds": "Time jobs spent queued before a worker picked them up",
+    "copilot_jobs_total": "Finished jobs by outcome",
+    "copilot_local_answers_total": "Follow-up questions answered from local chart data, or passed on to the model",
+    "copilot_image_pool_rejected_total": "Uploads turned away because the image process pool queue was full",
+    "copilot_scheduler_wait_seconds": "Time model requests waited for an upstream slot, by priority class",
+    "copilot_scheduler_dropped_total": "Model requests dropped because their deadline passed while queued, by priority class",
+}
+
+# Structured JSON log line per request/model call when COPILOT_REQUEST_LOG=1
+REQUEST_LOG = os.environ.get("COPILOT_REQUEST_LOG", "0") == "1"
+request_logger = logging.getLogger("copilot.requests")
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+# Set while a worker process runs a task, see collect_observations
+_collected = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    if _collected is not None:
+        _collected.append((name, value, labels))
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def stage(name):
+    return timer("copilot_stage_duration_seconds", stage=name)
+
+
+# A worker process's registry is never scraped: observations made there are collected into a
+# list that travels back with the task's result and is replayed into the parent's registry.
+# Worker processes run one task at a time, so a module-level list is enough.
+@contextmanager
+def collect_observations():
+    global _collected
+    _collected = observations = []
+    try:
+        yield observations
+    finally:
+        _collected = None
+
+
+def replay(observations):
+    for name, value, labels in observations:
+        observe(name, value, **labels)
+
+
+def record_usage(call_site, usage):
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            inc("copilot_tokens_total", usage[kind], call_site=call_site, type=kind.split("_")[0])
+
+
+def record_cache(cache, hit):
+    inc("copilot_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def log_request(event, **fields):
+    if REQUEST_LOG:
+        request_logger.info(json.dumps(dict(event=event, **fields), default=str))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"'.replace("\n", " ") for k, v in pairs) + "}"
+
+
+def render():
+    """Current metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]} for key, h in _histograms.items()}
+
+    lines = []
+    for kind, series in (("counter", counters), ("histogram", histograms)):
+        for name in sorted({name for name, _ in series}):
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name != name:
+                    continue
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(BUCKETS, value["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
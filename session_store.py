@@ -0,0 +1,286 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Conversation storage for the UI, outside st.session_state. Each session is a list of messages
+# ({"id", "role", "content", optional "image"}) plus pinned images; images are stored once by
+# content hash and messages only hold the hash. Every session is capped in bytes (oldest
+# messages are dropped first) and sessions idle for longer than the TTL are evicted together
+# with images nothing references any more. The in-memory store also has a cap for all sessions
+# together: past it, whole sessions are evicted, least recently used first.
+#
+# Message ids increase monotonically per session and are never reused, so callers can keep
+# positions in the history (see ConversationContext) across trims.
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def message_size(message):
+    return len(message["content"].encode("utf-8")) + len(message["role"])
+
+
+class MemorySessionStore:
+    def __init__(self, max_session_bytes=8 * 1024 * 1024, ttl=6 * 3600, sweep_interval=60, max_total_bytes=512 * 1024 * 1024):
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        # Least recently used first
+        self._sessions = {}
+        self._images = {}
+        # Message text plus image bytes across all sessions
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+
+    def _session(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            session = {"messages": [], "next_id": 0, "pinned": set(), "updated": 0}
+        self._sessions[session_id] = session
+        session["updated"] = time.time()
+        return session
+
+    def _store_image(self, data):
+        digest = image_hash(data)
+        if digest not in self._images:
+            self._images[digest] = data
+            self._bytes += len(data)
+        return digest
+
+    def _drop_session(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= sum(message_size(m) for m in session["messages"])
+
+    def put_image(self, session_id, data):
+        """Store an image for the session (kept until the session expires) and return its hash."""
+        with self._lock:
+            digest = self._store_image(data)
+            self._session(session_id)["pinned"].add(digest)
+            self._enforce_cap(session_id)
+            self._enforce_total_cap(session_id)
+        return digest
+
+    def get_image(self, digest):
+        with self._lock:
+            return self._images.get(digest)
+
+    def append_message(self, session_id, role, content, image=None):
+        """Add a message; image is raw bytes, stored by hash. Returns the stored message."""
+        with self._lock:
+            session = self._session(session_id)
+            message = {"id": session["next_id"], "role": role, "content": content}
+            session["next_id"] += 1
+            if image is not None:
+                message["image"] = self._store_image(image)
+            session["messages"].append(message)
+            self._bytes += message_size(message)
+            self._enforce_cap(session_id)
+            self._enforce_total_cap(session_id)
+            self._maybe_sweep()
+            return dict(message)
+
+    def messages(self, session_id):
+        with self._lock:
+            return [dict(message) for message in self._session(session_id)["messages"]]
+
+    def clear(self, session_id):
+        with self._lock:
+            self._drop_session(session_id)
+            self._collect_images()
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            session = self._session(session_id)
+            digests = set(session["pinned"]) | {m["image"] for m in session["messages"] if "image" in m}
+            return sum(message_size(m) for m in session["messages"]) + sum(len(self._images.get(d, b"")) for d in digests)
+
+    def _enforce_cap(self, session_id):
+        messages = self._sessions[session_id]["messages"]
+        trimmed = False
+        while len(messages) > 1 and self.session_bytes(session_id) > self.max_session_bytes:
+            self._bytes -= message_size(messages.pop(0))
+            trimmed = True
+        if trimmed:
+            self._collect_images()
+
+    def _enforce_total_cap(self, session_id):
+        # The session being written to is the most recently used one and is never evicted
+        while self._bytes > self.max_total_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == session_id:
+                break
+            self._drop_session(oldest)
+            self._collect_images()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        expired = [sid for sid, session in self._sessions.items() if now - session["updated"] > self.ttl]
+        for session_id in expired:
+            self._drop_session(session_id)
+        if expired:
+            self._collect_images()
+
+    def _collect_images(self):
+        referenced = set()
+        for session in self._sessions.values():
+            referenced |= session["pinned"]
+            referenced |= {m["image"] for m in session["messages"] if "image" in m}
+        for digest in list(self._images):
+            if digest not in referenced:
+                self._bytes -= len(self._images.pop(digest))
+
+
+class SQLiteSessionStore:
+    """Same interface as MemorySessionStore, kept in a local SQLite file so it uses no process memory."""
+
+    def __init__(self, path, max_session_bytes=8 * 1024 * 1024, ttl=6 * 3600, sweep_interval=60):
+        self.max_session_bytes = max_session_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, updated REAL NOT NULL, next_id INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS messages (session_id TEXT NOT NULL, id INTEGER NOT NULL, role TEXT NOT NULL,
+                                                 content TEXT NOT NULL, image TEXT, PRIMARY KEY (session_id, id));
+            CREATE TABLE IF NOT EXISTS pinned (session_id TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (session_id, hash));
+            CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        # The connection is in autocommit mode, so `with self._db` would not open a transaction.
+        # BEGIN IMMEDIATE takes the write lock up front: processes sharing the file cannot both
+        # read the same next_id or trim the same session.
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _touch(self, session_id):
+        self._db.execute(
+            "INSERT INTO sessions (id, updated, next_id) VALUES (?, ?, 0) ON CONFLICT (id) DO UPDATE SET updated = excluded.updated",
+            (session_id, time.time()))
+
+    def _store_image(self, data):
+        digest = image_hash(data)
+        self._db.execute("INSERT OR IGNORE INTO images (hash, data, size) VALUES (?, ?, ?)", (digest, data, len(data)))
+        return digest
+
+    def put_image(self, session_id, data):
+        with self._transaction():
+            self._touch(session_id)
+            digest = self._store_image(data)
+            self._db.execute("INSERT OR IGNORE INTO pinned (session_id, hash) VALUES (?, ?)", (session_id, digest))
+            self._enforce_cap(session_id)
+        return digest
+
+    def get_image(self, digest):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM images WHERE hash = ?", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def append_message(self, session_id, role, content, image=None):
+        with self._lock:
+            with self._transaction():
+                self._touch(session_id)
+                message_id = self._db.execute("SELECT next_id FROM sessions WHERE id = ?", (session_id,)).fetchone()[0]
+                self._db.execute("UPDATE sessions SET next_id = ? WHERE id = ?", (message_id + 1, session_id))
+                message = {"id": message_id, "role": role, "content": content}
+                if image is not None:
+                    message["image"] = self._store_image(image)
+                self._db.execute("INSERT INTO messages (session_id, id, role, content, image) VALUES (?, ?, ?, ?, ?)",
+                                 (session_id, message_id, role, content, message.get("image")))
+                self._enforce_cap(session_id)
+            self._maybe_sweep()
+            return message
+
+    def messages(self, session_id):
+        with self._lock:
+            self._touch(session_id)
+            rows = self._db.execute("SELECT id, role, content, image FROM messages WHERE session_id = ? ORDER BY id",
+                                    (session_id,)).fetchall()
+        messages = []
+        for message_id, role, content, image in rows:
+            message = {"id": message_id, "role": role, "content": content}
+            if image is not None:
+                message["image"] = image
+            messages.append(message)
+        return messages
+
+    def clear(self, session_id):
+        with self._transaction():
+            for table, column in (("messages", "session_id"), ("pinned", "session_id"), ("sessions", "id")):
+                self._db.execute(f"DELETE FROM {table} WHERE {column} = ?", (session_id,))
+            self._collect_images()
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            text = self._db.execute("SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB)) + LENGTH(role)), 0) FROM messages WHERE session_id = ?",
+                                    (session_id,)).fetchone()[0]
+            images = self._db.execute("""
+                SELECT COALESCE(SUM(size), 0) FROM images WHERE hash IN (
+                    SELECT image FROM messages WHERE session_id = ? AND image IS NOT NULL
+                    UNION SELECT hash FROM pinned WHERE session_id = ?)""", (session_id, session_id)).fetchone()[0]
+        return text + images
+
+    def _enforce_cap(self, session_id):
+        trimmed = False
+        while self.session_bytes(session_id) > self.max_session_bytes:
+            oldest = self._db.execute("SELECT MIN(id), COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()
+            if oldest[1] <= 1:
+                break
+            self._db.execute("DELETE FROM messages WHERE session_id = ? AND id = ?", (session_id, oldest[0]))
+            trimmed = True
+        if trimmed:
+            self._collect_images()
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        with self._transaction():
+            expired = "SELECT id FROM sessions WHERE updated < ?"
+            cutoff = now - self.ttl
+            self._db.execute(f"DELETE FROM messages WHERE session_id IN ({expired})", (cutoff,))
+            self._db.execute(f"DELETE FROM pinned WHERE session_id IN ({expired})", (cutoff,))
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+            self._collect_images()
+
+    def _collect_images(self):
+        self._db.execute("""
+            DELETE FROM images WHERE hash NOT IN (
+                SELECT image FROM messages WHERE image IS NOT NULL UNION SELECT hash FROM pinned)""")
+
+
+def session_store_from_env():
+    """COPILOT_SESSION_STORE=memory (default) or sqlite, with COPILOT_SESSION_DB as the file."""
+    max_session_bytes = int(os.environ.get("COPILOT_SESSION_MAX_BYTES", 8 * 1024 * 1024))
+    ttl = float(os.environ.get("COPILOT_SESSION_TTL", 6 * 3600))
+    if os.environ.get("COPILOT_SESSION_STORE", "memory") == "sqlite":
+        path = os.environ.get("COPILOT_SESSION_DB", os.path.join(".cache", "sessions.sqlite3"))
+        return SQLiteSessionStore(path, max_session_bytes=max_session_bytes, ttl=ttl)
+    max_total_bytes = int(os.environ.get("COPILOT_SESSION_STORE_MAX_BYTES", 512 * 1024 * 1024))
+    return MemorySessionStore(max_session_bytes=max_session_bytes, ttl=ttl, max_total_bytes=max_total_bytes)
@@ -0,0 +1,86 @@
+import json
+import re
+
+# Start of the question list: the "questions" array of the expected object or, failing that,
+# a bare array at the start of the response (optionally inside a code fence)
+QUESTIONS_ARRAY = re.compile(r'"questions"\s*:\s*\[')
+BARE_ARRAY = re.compile(r"^\s*(?:```[a-zA-Z]*\s*)?\[")
+
+
+# Incremental parser for a streamed suggestion response. feed() takes the next chunk of text
+# and returns the questions whose JSON strings closed in it, so each one can be shown as soon
+# as it is complete. Anything around the array (code fences, prose, a truncated tail) is
+# ignored, as are items that are not strings, and strings that do not decode are skipped rather
+# than failing the whole response.
+class SuggestionParser:
+    def __init__(self, limit=4):
+        self.limit = limit
+        self.questions = []
+        self._buffer = ""
+        self._pos = None
+        # Nesting depth inside the question array
+        self._depth = 0
+        self._done = False
+
+    def feed(self, text):
+        self._buffer += text
+        if self._done:
+            return []
+        if self._pos is None:
+            match = QUESTIONS_ARRAY.search(self._buffer) or BARE_ARRAY.match(self._buffer)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        found = []
+        while self._pos < len(self._buffer) and len(self.questions) < self.limit:
+            char = self._buffer[self._pos]
+            if char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                if self._depth == 0:
+                    self._done = True
+                    break
+                self._depth -= 1
+            if char != '"':
+                self._pos += 1
+                continue
+            end = self._string_end(self._pos + 1)
+            if end is None:
+                # The string is still streaming in
+                break
+            start, self._pos = self._pos, end + 1
+            # Only the array's own items are questions; strings inside nested objects or
+            # arrays (keys, ids, ...) are skipped like any other non-string item
+            if self._depth:
+                continue
+            try:
+                question = json.loads(self._buffer[start:end + 1])
+            except ValueError:
+                question = None
+            if isinstance(question, str) and question.strip():
+                self.questions.append(question)
+                found.append(question)
+
+        if len(self.questions) >= self.limit:
+            self._done = True
+        return found
+
+    def _string_end(self, start):
+        """Index of the quote closing a JSON string whose content starts at start, or None if it has not arrived."""
+        pos = start
+        while pos < len(self._buffer):
+            char = self._buffer[pos]
+            if char == "\\":
+                pos += 2
+                continue
+            if char == '"':
+                return pos
+            pos += 1
+        return None
+
+
+def parse_questions(text, limit=4):
+    parser = SuggestionParser(limit)
+    parser.feed(text)
+    return parser.questions
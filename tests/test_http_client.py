@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from http_client import PRIORITY_SHARES, DeadlineExceeded, TokenBucket, UpstreamScheduler
+
+
+class FakeBucket:
+    """Rate limiter with a fixed number of requests left, refilled by the test."""
+
+    def __init__(self, available):
+        self.available = available
+
+    def try_reserve(self, tokens):
+        if self.available > 0:
+            self.available -= 1
+            return 0.0
+        return 60.0
+
+
+def enqueue(scheduler, priority, deadline=None):
+    return scheduler._enqueue(priority, deadline, 0, lambda: None)
+
+
+def redispatch(scheduler):
+    with scheduler._lock:
+        scheduler._dispatch()
+
+
+def test_background_classes_leave_reserved_slots_free():
+    scheduler = UpstreamScheduler(8, PRIORITY_SHARES, reserved_interactive=2)
+    analysis = [enqueue(scheduler, "analysis") for _ in range(6)]
+    batch = [enqueue(scheduler, "batch") for _ in range(4)]
+    # analysis may use 6 slots on its own, but the background classes share only 8 - 2
+    assert sum(waiter.granted for waiter in analysis + batch) == 6
+    interactive = [enqueue(scheduler, "interactive") for _ in range(2)]
+    assert all(waiter.granted for waiter in interactive)
+
+
+def test_free_slot_goes_to_most_urgent_waiter():
+    scheduler = UpstreamScheduler(2, PRIORITY_SHARES)
+    held = [enqueue(scheduler, "interactive") for _ in range(2)]
+    assert all(waiter.granted for waiter in held)
+    batch = enqueue(scheduler, "batch")
+    interactive = enqueue(scheduler, "interactive")
+    scheduler.release("interactive")
+    assert interactive.granted and not batch.granted
+    scheduler.release("interactive")
+    assert batch.granted
+
+
+def test_rate_limit_quota_is_taken_in_priority_order():
+    bucket = FakeBucket(available=3)
+    scheduler = UpstreamScheduler(32, PRIORITY_SHARES, reserved_interactive=4, bucket=bucket)
+    batch = [enqueue(scheduler, "batch") for _ in range(5)]
+    assert sum(waiter.granted for waiter in batch) == 3
+    interactive = enqueue(scheduler, "interactive")
+    assert not interactive.granted
+
+    bucket.available = 1
+    redispatch(scheduler)
+    assert interactive.granted
+    assert sum(waiter.granted for waiter in batch) == 3
+    scheduler._timer.cancel()
+
+
+def test_waiter_past_its_deadline_is_dropped():
+    scheduler = UpstreamScheduler(1, PRIORITY_SHARES)
+    enqueue(scheduler, "interactive")
+    with pytest.raises(DeadlineExceeded):
+        with scheduler.slot("suggestions", deadline=time.monotonic() + 0.05):
+            pass
+    assert not scheduler._queues["suggestions"]
+
+
+def test_slot_is_released_on_exit():
+    scheduler = UpstreamScheduler(1, PRIORITY_SHARES)
+    with scheduler.slot("interactive"):
+        waiter = enqueue(scheduler, "analysis")
+        assert not waiter.granted
+    assert waiter.granted
+
+
+def test_token_bucket_does_not_take_quota_it_has_to_wait_for():
+    bucket = TokenBucket(requests_per_minute=60)
+    assert [bucket.try_reserve(0) for _ in range(60)] == [0.0] * 60
+    wait = bucket.try_reserve(0)
+    assert 0.9 < wait <= 1.0
+    # Asking again does not push the wait further out
+    assert bucket.try_reserve(0) <= wait
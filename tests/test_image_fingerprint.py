@@ -0,0 +1,46 @@
+import json
+
+from image_fingerprint import FingerprintIndex
+
+
+def lines(path):
+    return path.read_text(encoding="utf-8").splitlines()
+
+
+def test_torn_line_does_not_lose_the_index(tmp_path):
+    path = tmp_path / "fingerprints.jsonl"
+    index = FingerprintIndex(str(path))
+    index.add(0b1111, "a")
+    index.add(0b0000, "b")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"fingerprint": 12, "ke')
+
+    reloaded = FingerprintIndex(str(path))
+    assert [key for _, key in reloaded.search(0b1111, 4)] == ["a", "b"]
+    reloaded.add(0b0111, "c")
+
+    again = FingerprintIndex(str(path))
+    assert sorted(key for _, key in again.search(0b1111, 4)) == ["a", "b", "c"]
+
+
+def test_only_newest_entries_are_kept(tmp_path):
+    path = tmp_path / "fingerprints.jsonl"
+    index = FingerprintIndex(str(path), max_entries=4)
+    for i in range(6):
+        index.add(i, f"k{i}")
+
+    assert sorted(key for _, key in index.search(0, 64)) == ["k2", "k3", "k4", "k5"]
+    # Two evicted entries exceed the slack of one: the file was compacted to the live entries
+    assert [json.loads(line)["key"] for line in lines(path)] == ["k2", "k3", "k4", "k5"]
+    assert sorted(key for _, key in FingerprintIndex(str(path), max_entries=4).search(0, 64)) == ["k2", "k3", "k4", "k5"]
+
+
+def test_file_stays_bounded(tmp_path):
+    path = tmp_path / "fingerprints.jsonl"
+    index = FingerprintIndex(str(path), max_entries=100)
+    for i in range(1000):
+        index.add(i, f"k{i}")
+
+    assert len(lines(path)) <= 125
+    assert len(index._tree) <= 125
+    assert len(index.search(0, 64)) == 100
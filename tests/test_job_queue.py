@@ -0,0 +1,71 @@
+import time
+
+from job_queue import JobQueue
+
+
+def make_queue(tmp_path, **kwargs):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **kwargs)
+
+
+def test_claims_oldest_job_once(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.submit(b"one", webhook="http://localhost/hook")
+    second = queue.submit(b"two")
+
+    job = queue.claim()
+    assert (job["id"], job["input"], job["webhook"], job["attempts"]) == (first, b"one", "http://localhost/hook", 1)
+    assert queue.claim()["id"] == second
+    assert queue.claim() is None
+    assert queue.get(first)["status"] == "running"
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = make_queue(tmp_path, lease=0.05)
+    job_id = queue.submit(b"data")
+    queue.claim()
+    assert queue.claim() is None
+
+    time.sleep(0.1)
+    job = queue.claim()
+    assert (job["id"], job["attempts"]) == (job_id, 2)
+
+
+def test_gives_up_after_max_attempts(tmp_path):
+    queue = make_queue(tmp_path, lease=0.01, max_attempts=2)
+    job_id = queue.submit(b"data")
+    for _ in range(2):
+        assert queue.claim()["id"] == job_id
+        time.sleep(0.05)
+
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", 2, "Gave up after 2 attempts")
+
+
+def test_finished_jobs_are_not_claimed_and_are_pruned(tmp_path):
+    queue = make_queue(tmp_path, retention=0)
+    done = queue.submit(b"one")
+    failed = queue.submit(b"two")
+    queue.claim(), queue.claim()
+    queue.complete(done, {"openai_analysis": "ok"})
+    queue.fail(failed, "boom")
+
+    assert queue.claim() is None
+    assert queue.get(done)["result"] == {"openai_analysis": "ok"}
+    assert queue.get(failed)["error"] == "boom"
+    time.sleep(0.01)
+    queue.prune()
+    assert queue.get(done) is None and queue.get(failed) is None
+
+
+def test_two_connections_never_claim_the_same_job(tmp_path):
+    queues = [make_queue(tmp_path) for _ in range(2)]
+    submitted = {queues[0].submit(b"x") for _ in range(10)}
+    claimed = []
+    while True:
+        jobs = [queue.claim() for queue in queues]
+        if not any(jobs):
+            break
+        claimed += [job["id"] for job in jobs if job]
+
+    assert sorted(claimed) == sorted(submitted)
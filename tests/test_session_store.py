@@ -0,0 +1,62 @@
+import threading
+
+from session_store import MemorySessionStore, SQLiteSessionStore, image_hash
+
+
+def test_store_cap_evicts_least_recently_used_sessions():
+    store = MemorySessionStore(max_session_bytes=10_000, max_total_bytes=5_000)
+    store.put_image("a", b"a" * 2_000)
+    store.put_image("b", b"b" * 2_000)
+    store.messages("a")
+    store.put_image("c", b"c" * 2_000)
+
+    assert set(store._sessions) == {"a", "c"}
+    assert store.get_image(image_hash(b"a" * 2_000)) is not None
+    assert store.get_image(image_hash(b"b" * 2_000)) is None
+    assert store._bytes == 4_000
+
+
+def test_shared_images_are_counted_once():
+    store = MemorySessionStore(max_total_bytes=5_000)
+    store.append_message("a", "user", "hi", image=b"x" * 3_000)
+    store.append_message("b", "user", "hi", image=b"x" * 3_000)
+
+    assert len(store._sessions) == 2
+    assert store._bytes == 3_000 + 2 * len("hi" + "user")
+
+
+def test_session_being_written_is_kept_over_the_cap():
+    store = MemorySessionStore(max_session_bytes=10_000, max_total_bytes=1_000)
+    store.put_image("a", b"a" * 2_000)
+
+    assert store.messages("a") == []
+    assert "a" in store._sessions
+
+
+def test_counter_follows_trims_and_clears():
+    store = MemorySessionStore(max_session_bytes=100)
+    for i in range(20):
+        store.append_message("a", "user", "message %02d" % i)
+    store.append_message("b", "user", "hello", image=b"y" * 50)
+
+    assert store._bytes == store.session_bytes("a") + store.session_bytes("b")
+    store.clear("b")
+    assert store._bytes == store.session_bytes("a")
+
+
+def test_sqlite_stores_sharing_a_file_never_reuse_message_ids(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    stores = [SQLiteSessionStore(path) for _ in range(4)]
+
+    def append(store):
+        for i in range(25):
+            store.append_message("shared", "user", f"message {i}")
+
+    threads = [threading.Thread(target=append, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [message["id"] for message in stores[0].messages("shared")]
+    assert ids == list(range(100))
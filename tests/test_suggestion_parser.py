@@ -0,0 +1,78 @@
+from suggestion_parser import SuggestionParser, parse_questions
+
+
+def feed_in_pieces(text, size):
+    parser = SuggestionParser()
+    found = []
+    for i in range(0, len(text), size):
+        found += parser.feed(text[i:i + size])
+    return found
+
+
+def test_questions_object():
+    assert parse_questions('{"questions": ["What is the trend?", "Any outliers?"]}') == ["What is the trend?", "Any outliers?"]
+
+
+def test_bare_array_in_code_fence():
+    assert parse_questions('```json\n["Q1?", "Q2?"]\n```') == ["Q1?", "Q2?"]
+
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    assert parse_questions(r'{"questions": ["Why is \"line 2\" [down]?", "Q2?"]}') == ['Why is "line 2" [down]?', "Q2?"]
+
+
+def test_nested_objects_are_skipped():
+    text = '{"questions": [{"question": "What is the trend?", "id": 1}, "Any outliers?", ["nested"], {"id": 2}]}'
+    assert parse_questions(text) == ["Any outliers?"]
+
+
+def test_limit():
+    assert parse_questions('{"questions": ["a", "b", "c", "d", "e"]}', limit=4) == ["a", "b", "c", "d"]
+
+
+def test_non_string_and_blank_items_are_skipped():
+    assert parse_questions('{"questions": [1, null, " ", "Q?"]}') == ["Q?"]
+
+
+def test_text_after_the_array_is_ignored():
+    assert parse_questions('{"questions": ["Q1?"], "other": ["not a question"]}') == ["Q1?"]
+
+
+def test_streamed_in_small_pieces():
+    text = '{"questions": [{"q": "x"}, "First?", "Sec\\"ond?", "Third?"]}'
+    for size in (1, 2, 3, 7):
+        assert feed_in_pieces(text, size) == ["First?", 'Sec"ond?', "Third?"]
+
+
+def test_truncated_response_keeps_complete_questions():
+    assert parse_questions('{"questions": ["Q1?", "Q2') == ["Q1?"]
+
+
+def stub_stream(monkeypatch, respond):
+    import copilot_core
+
+    calls = []
+
+    def stream_chat_completion(payload, call_site, deadline=None):
+        calls.append((payload["model"], deadline is not None))
+        return respond()
+
+    monkeypatch.setattr(copilot_core, "stream_chat_completion", stream_chat_completion)
+    return copilot_core, calls
+
+
+def test_dropped_suggestion_request_is_not_escalated(monkeypatch):
+    import http_client
+
+    def respond():
+        raise http_client.DeadlineExceeded("stale")
+
+    copilot_core, calls = stub_stream(monkeypatch, respond)
+    assert copilot_core.generate_suggestions([]) == []
+    assert calls == [("gpt-4o-mini", True)]
+
+
+def test_answer_without_questions_is_escalated(monkeypatch):
+    copilot_core, calls = stub_stream(monkeypatch, lambda: iter(['{"questions": []}']))
+    assert copilot_core.generate_suggestions([]) == []
+    assert calls == [("gpt-4o-mini", True), ("gpt-4o", False)]
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import copilot_core
+
+# Headless ingestion: python watch_folder.py DIRECTORY
+# Charts dropped into (or re-exported over) a directory are analyzed and every result is
+# appended to a JSONL feed. Every scan costs one stat per file; only files whose mtime or size
+# changed are read and hashed, and only files whose content hash changed are analyzed.
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".tif")
+
+logger = logging.getLogger("copilot.watch")
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Polls a directory every interval seconds. A new or changed file is picked up once its mtime
+# and size have held still for debounce seconds, so files still being written and bursts of
+# re-exports are analyzed once, after they settle. At most workers files are analyzed at once;
+# the rest wait for the next scan. The feed doubles as the watcher's state: on start the last
+# record per file is read back, so a restart only analyzes what changed while it was down (and
+# what failed; within a run a failed file is only retried once it changes).
+class FolderWatcher:
+    def __init__(self, directory, feed_path, interval=5.0, debounce=2.0, workers=4):
+        self.directory = os.path.abspath(directory)
+        self.feed_path = feed_path
+        self.interval = interval
+        self.debounce = debounce
+        self.workers = workers
+        # path -> {"mtime", "size", "sha256"} of the version last processed
+        self.known = {}
+        # path -> ((mtime, size), time that stat was first seen)
+        self.pending = {}
+        # future -> (path, (mtime, size))
+        self.in_flight = {}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="watch")
+        self._stopped = threading.Event()
+        self._load_feed()
+
+    @classmethod
+    def from_env(cls, directory, feed_path=None):
+        return cls(
+            directory,
+            feed_path or os.environ.get("COPILOT_WATCH_FEED", os.path.join(".cache", "watch_results.jsonl")),
+            interval=float(os.environ.get("COPILOT_WATCH_INTERVAL", 5.0)),
+            debounce=float(os.environ.get("COPILOT_WATCH_DEBOUNCE", 2.0)),
+            workers=int(os.environ.get("COPILOT_WATCH_WORKERS", 4)),
+        )
+
+    def _load_feed(self):
+        try:
+            with open(self.feed_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    if record.get("deleted") or "error" in record:
+                        # Failed files are retried after a restart
+                        self.known.pop(record["path"], None)
+                    elif "sha256" in record:
+                        self.known[record["path"]] = {key: record[key] for key in ("mtime", "size", "sha256")}
+        except FileNotFoundError:
+            pass
+
+    def _append(self, record):
+        directory = os.path.dirname(self.feed_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.feed_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _listing(self):
+        """{path: (mtime_ns, size)} of the chart files in the directory."""
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Skip hidden and partial files (editors and copy tools write those first)
+                if entry.name.startswith((".", "~")) or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                except FileNotFoundError:
+                    continue
+        return files
+
+    def scan(self):
+        now = time.monotonic()
+        files = self._listing()
+        busy = {path for path, _ in self.in_flight.values()}
+
+        for path, stat in files.items():
+            known = self.known.get(path)
+            if known and (known["mtime"], known["size"]) == stat:
+                self.pending.pop(path, None)
+                continue
+            previous = self.pending.get(path)
+            if previous is None or previous[0] != stat:
+                self.pending[path] = (stat, now)
+
+        for path in list(self.pending):
+            if path not in files:
+                del self.pending[path]
+        for path in [path for path in self.known if path not in files and path not in busy]:
+            del self.known[path]
+            self._append({"path": path, "deleted": True, "time": time.time()})
+            logger.info("removed %s", path)
+
+        ready = [path for path, (stat, seen) in self.pending.items() if now - seen >= self.debounce and path not in busy]
+        for path in sorted(ready, key=lambda path: self.pending[path][1]):
+            if len(self.in_flight) >= self.workers:
+                break
+            stat, _ = self.pending.pop(path)
+            future = self._executor.submit(self.process, path, stat, self.known.get(path, {}).get("sha256"))
+            self.in_flight[future] = (path, stat)
+
+    def process(self, path, stat, previous_hash):
+        """Feed record for one version of a file, flagged unchanged when only its mtime changed."""
+        with open(path, "rb") as f:
+            data = f.read()
+        sha256 = file_hash(data)
+        record = {"path": path, "mtime": stat[0], "size": stat[1], "sha256": sha256}
+        if sha256 == previous_hash:
+            return dict(record, unchanged=True)
+
+        start = time.perf_counter()
+        try:
+            pages = copilot_core.page_count(data)
+            if pages > 1:
+                record["pages"] = sorted(copilot_core.analyze_pages(data, pages), key=lambda page: page["page"])
+                failed = [page["page"] for page in record["pages"] if "error" in page]
+                if failed:
+                    # Retried like any failed file (on change, or after a restart)
+                    record["error"] = f"{len(failed)} of {len(record['pages'])} pages failed (pages {', '.join(map(str, failed))})"
+            else:
+                record["openai_analysis"] = copilot_core.analyze_image_bytes(data, priority="batch")
+        except Exception as e:
+            record["error"] = str(e) or type(e).__name__
+        record.update(time=time.time(), seconds=round(time.perf_counter() - start, 3))
+        return record
+
+    def collect(self, timeout=0):
+        """Write the records of finished files to the feed."""
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            path, stat = self.in_flight.pop(future)
+            try:
+                record = future.result()
+            except OSError as e:
+                # Deleted or unreadable between the scan and the read; the next scan sorts it out
+                logger.warning("could not read %s: %s", path, e)
+                continue
+
+            self.known[path] = {"mtime": record["mtime"], "size": record["size"], "sha256": record["sha256"]}
+            if record.pop("unchanged", False):
+                # Touched but identical; remembered for this run without a feed record
+                continue
+            self._append(record)
+            if "error" in record:
+                logger.warning("failed %s: %s", path, record["error"])
+            else:
+                logger.info("analyzed %s in %ss", path, record["seconds"])
+
+    def run(self):
+        logger.info("watching %s, results in %s", self.directory, self.feed_path)
+        while not self._stopped.is_set():
+            self.scan()
+            deadline = time.monotonic() + self.interval
+            # Finished files are written out as they complete, not at the next scan
+            while self.in_flight and time.monotonic() < deadline and not self._stopped.is_set():
+                self.collect(timeout=deadline - time.monotonic())
+            self._stopped.wait(max(0, deadline - time.monotonic()))
+        while self.in_flight:
+            self.collect(timeout=None)
+        self._executor.shutdown()
+
+    def stop(self):
+        self._stopped.set()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Analyze charts as they are added to or changed in a directory")
+    parser.add_argument("directory")
+    parser.add_argument("--feed", help="JSONL file the results are appended to (default: COPILOT_WATCH_FEED)")
+    parser.add_argument("--once", action="store_true", help="process what is there now, then exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    watcher = FolderWatcher.from_env(args.directory, args.feed)
+    if args.once:
+        watcher.debounce = 0
+        watcher.scan()
+        while watcher.in_flight:
+            watcher.collect(timeout=None)
+            watcher.scan()
+    else:
+        # Finish the files in flight on Ctrl-C or SIGTERM before exiting
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: watcher.stop())
+        watcher.run()